@@ -1,180 +1,184 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.security import HTTPBearer
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Request
+from fastapi.responses import ORJSONResponse
 from typing import Dict, Any
-import structlog
+import logging
 import uuid
 import time
+from datetime import datetime
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.services.audit_service import audit_service
 from app.models.document import AuditSession, ValidationResult
-from app.database.database import get_db
-from app.utils.security import verify_token
-from app.utils.metrics import track_operation
+from app.database.database import AsyncSessionLocal, get_db
+from app.deps import get_current_user
+from app.utils.metrics import track_operation, record_in_background
 
-logger = structlog.get_logger()
-router = APIRouter()
-security = HTTPBearer()
+logger = logging.getLogger(__name__)
+router = APIRouter(default_response_class=ORJSONResponse)
 
 @router.post("/sessions")
 async def create_audit_session(
     request: Dict[str, Any],
-    token: str = Depends(security),
-    db = Depends(get_db)
+    user_data: Dict[str, Any] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Create a new audit session"""
-    try:
-        user_data = verify_token(token.credentials)
-        
-        session = AuditSession(
-            session_name=request.get("session_name", f"Audit_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"),
-            pdf_document_id=request["pdf_document_id"],
-            excel_document_ids=request["excel_document_ids"],
-            user_id=user_data["sub"],
-            mapping_data=request.get("mapping_data", {})
-        )
-        
-        db.add(session)
-        db.commit()
-        db.refresh(session)
-        
-        return {
-            "session_id": session.id,
-            "session_name": session.session_name,
-            "status": session.status
-        }
-        
-    except Exception as e:
-        logger.error("Failed to create audit session", error=str(e))
-        raise HTTPException(status_code=500, detail=str(e))
+    session = AuditSession(
+        session_name=request.get("session_name", f"Audit_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"),
+        pdf_document_id=request["pdf_document_id"],
+        excel_document_ids=request["excel_document_ids"],
+        user_id=user_data["sub"],
+        mapping_data=request.get("mapping_data", {})
+    )
+    
+    db.add(session)
+    await db.commit()
+    await db.refresh(session)
+    
+    return {
+        "session_id": session.id,
+        "session_name": session.session_name,
+        "status": session.status
+    }
 
-@router.post("/sessions/{session_id}/run")
-async def run_audit(
-    session_id: int,
-    request: Dict[str, Any],
-    token: str = Depends(security),
-    db = Depends(get_db)
-):
-    """Run audit for a session"""
-    start_time = time.time()
+async def _run_audit_job(session_id: int, pdf_data: Dict[str, Any], excel_data: Dict[str, Any], user_mappings: Dict[str, Any]):
+    """Background task to run an audit and store its results on the session"""
+    start_time = time.perf_counter()
     operation_session_id = str(uuid.uuid4())
     
     try:
-        user_data = verify_token(token.credentials)
-        
-        # Get session
-        session = db.query(AuditSession).filter(
-            AuditSession.id == session_id,
-            AuditSession.user_id == user_data["sub"]
-        ).first()
-        
-        if not session:
-            raise HTTPException(status_code=404, detail="Audit session not found")
-        
-        # Update session status
-        session.status = "in_progress"
-        db.commit()
-        
-        # Get PDF and Excel data from the documents
-        pdf_data = request.get("pdf_data", {})
-        excel_data = request.get("excel_data", {})
-        user_mappings = request.get("user_mappings", {})
-        
-        # Run the audit
+        # The model calls take seconds to minutes, so no database session is held meanwhile
         audit_results = await audit_service.run_comprehensive_audit(
             pdf_data=pdf_data,
             excel_data=excel_data,
             user_mappings=user_mappings
         )
         
-        # Save results
-        session.audit_results = audit_results
-        session.status = "completed"
-        session.completion_date = datetime.utcnow()
-        
-        # Save individual validation results
-        for result in audit_results["detailed_results"]:
-            validation_record = ValidationResult(
-                audit_session_id=session.id,
-                slide_number=result.get("pdf_slide", 0),
-                extracted_value=str(result.get("pdf_value", "")),
-                source_sheet=result.get("excel_sheet"),
-                source_cell=result.get("excel_cell"),
-                source_value=str(result.get("excel_value", "")),
-                validation_status=result.get("validation_status"),
-                confidence_score=result.get("confidence_score"),
-                ai_reasoning=result.get("ai_reasoning")
+        async with AsyncSessionLocal() as db:
+            # Save individual validation results as one multi-row INSERT
+            validation_rows = [
+                {
+                    "audit_session_id": session_id,
+                    "slide_number": result.get("pdf_slide", 0),
+                    "extracted_value": str(result.get("pdf_value", "")),
+                    "source_sheet": result.get("excel_sheet"),
+                    "source_cell": result.get("excel_cell"),
+                    "source_value": str(result.get("excel_value", "")),
+                    "validation_status": result.get("validation_status"),
+                    "confidence_score": result.get("confidence_score"),
+                    "ai_reasoning": result.get("ai_reasoning")
+                }
+                for result in audit_results["detailed_results"]
+            ]
+            if validation_rows:
+                await db.execute(insert(ValidationResult), validation_rows)
+            
+            await db.execute(
+                update(AuditSession)
+                .where(AuditSession.id == session_id)
+                .values(audit_results=audit_results, status="completed", completion_date=func.now())
             )
-            db.add(validation_record)
-        
-        db.commit()
+            await db.commit()
         
-        latency = (time.time() - start_time) * 1000
-        await track_operation("audit", latency, True, operation_session_id)
-        
-        return {
-            "session_id": session.id,
-            "audit_results": audit_results,
-            "status": "completed"
-        }
+        latency = (time.perf_counter() - start_time) * 1000
+        record_in_background(track_operation("audit", latency, True, operation_session_id))
         
     except Exception as e:
-        # Update session status to failed
-        if 'session' in locals():
-            session.status = "failed"
-            db.commit()
-        
-        latency = (time.time() - start_time) * 1000
-        await track_operation("audit", latency, False, operation_session_id, str(e))
-        logger.error("Audit failed", session_id=session_id, error=str(e))
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.exception("Audit failed for session %s: %s", session_id, e)
+        latency = (time.perf_counter() - start_time) * 1000
+        record_in_background(track_operation("audit", latency, False, operation_session_id, str(e)))
+        
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(update(AuditSession).where(AuditSession.id == session_id).values(status="failed"))
+                await db.commit()
+        except Exception:
+            logger.exception("Could not mark audit session %s as failed", session_id)
 
-@router.get("/sessions/{session_id}")
-async def get_audit_session(
+@router.post("/sessions/{session_id}/run", status_code=202)
+async def run_audit(
     session_id: int,
-    token: str = Depends(security),
-    db = Depends(get_db)
+    request: Dict[str, Any],
+    http_request: Request,
+    background_tasks: BackgroundTasks,
+    user_data: Dict[str, Any] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get audit session details"""
-    user_data = verify_token(token.credentials)
-    
-    session = db.query(AuditSession).filter(
-        AuditSession.id == session_id,
-        AuditSession.user_id == user_data["sub"]
-    ).first()
+    """Start an audit for a session; poll the session for its results"""
+    # Get session
+    session = (await db.execute(
+        select(AuditSession).where(
+            AuditSession.id == session_id,
+            AuditSession.user_id == user_data["sub"]
+        )
+    )).scalar_one_or_none()
     
     if not session:
         raise HTTPException(status_code=404, detail="Audit session not found")
     
+    # Update session status
+    session.status = "in_progress"
+    await db.commit()
+    
+    # The audit runs after the response is sent
+    background_tasks.add_task(
+        _run_audit_job,
+        session.id,
+        request.get("pdf_data", {}),
+        request.get("excel_data", {}),
+        request.get("user_mappings", {})
+    )
+    
     return {
-        "id": session.id,
-        "session_name": session.session_name,
+        "session_id": session.id,
         "status": session.status,
-        "created_date": session.created_date.isoformat(),
-        "completion_date": session.completion_date.isoformat() if session.completion_date else None,
-        "audit_results": session.audit_results
+        "status_url": str(http_request.url_for("get_audit_session", session_id=session.id))
     }
 
+@router.get("/sessions/{session_id}")
+async def get_audit_session(
+    session_id: int,
+    user_data: Dict[str, Any] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get audit session details"""
+    session = (await db.execute(
+        select(
+            AuditSession.id,
+            AuditSession.session_name,
+            AuditSession.status,
+            AuditSession.created_date,
+            AuditSession.completion_date,
+            AuditSession.audit_results
+        ).where(
+            AuditSession.id == session_id,
+            AuditSession.user_id == user_data["sub"]
+        )
+    )).mappings().one_or_none()
+    
+    if not session:
+        raise HTTPException(status_code=404, detail="Audit session not found")
+    
+    return dict(session)
+
 @router.get("/sessions")
 async def list_audit_sessions(
-    token: str = Depends(security),
-    db = Depends(get_db)
+    user_data: Dict[str, Any] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """List all audit sessions for the user"""
-    user_data = verify_token(token.credentials)
-    
-    sessions = db.query(AuditSession).filter(
-        AuditSession.user_id == user_data["sub"]
-    ).order_by(AuditSession.created_date.desc()).all()
+    # Only the listed columns; audit_results and mapping_data can be large
+    sessions = (await db.execute(
+        select(
+            AuditSession.id,
+            AuditSession.session_name,
+            AuditSession.status,
+            AuditSession.created_date,
+            AuditSession.completion_date
+        )
+        .where(AuditSession.user_id == user_data["sub"])
+        .order_by(AuditSession.created_date.desc())
+    )).mappings().all()
     
-    return {
-        "sessions": [
-            {
-                "id": session.id,
-                "session_name": session.session_name,
-                "status": session.status,
-                "created_date": session.created_date.isoformat(),
-                "completion_date": session.completion_date.isoformat() if session.completion_date else None
-            }
-            for session in sessions
-        ]
-    }
\ No newline at end of file
+    return {"sessions": [dict(session) for session in sessions]}
@@ -1,37 +1,33 @@
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import Dict, Any
-import structlog
+import asyncio
+import logging
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
 from passlib.context import CryptContext
 
-from app.config import settings
-from app.utils.security import create_access_token, verify_password, get_password_hash
-from app.database.database import get_db
-from app.models.document import User
-from sqlalchemy.orm import Session
+from app.deps import get_current_user
+from app.utils.security import create_access_token, verify_password
 
-logger = structlog.get_logger()
+logger = logging.getLogger(__name__)
 router = APIRouter()
-security = HTTPBearer()
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# Mock users for development - replace with database integration
+# Mock users for development - replace with database integration.
+# Hashes are precomputed so importing this module does not pay for bcrypt rounds.
 MOCK_USERS = {
     "demo": {
         "username": "demo",
         "email": "demo@veritas.com",
-        "hashed_password": get_password_hash("demo123"),
+        "hashed_password": "$2b$12$Y0JRpIALldgc398YZ3/Y0u.mFt2I3jOMN.UXt95iSex4IEsUdw1ZS",  # demo123
         "role": "analyst"
     },
     "admin": {
         "username": "admin", 
         "email": "admin@veritas.com",
-        "hashed_password": get_password_hash("admin123"),
+        "hashed_password": "$2b$12$GV2sJPXLUcYV//UbDKl5X.2PbZQVPe0xdcLp/jAzj1DE2nbAXs4XK",  # admin123
         "role": "administrator"
     }
 }
@@ -48,52 +44,43 @@ class TokenResponse(BaseModel):
 @router.post("/login", response_model=TokenResponse)
 async def login(request: LoginRequest):
     """Authenticate user and return access token"""
-    try:
-        user = MOCK_USERS.get(request.username)
-        
-        if not user or not verify_password(request.password, user["hashed_password"]):
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        
-        access_token = create_access_token(
-            data={"sub": user["username"], "email": user["email"], "role": user["role"]}
-        )
-        
-        return TokenResponse(
-            access_token=access_token,
-            token_type="bearer",
-            user={
-                "username": user["username"],
-                "email": user["email"],
-                "role": user["role"]
-            }
-        )
-        
-    except Exception as e:
-        logger.error("Login failed", error=str(e))
-        raise HTTPException(status_code=500, detail="Login failed")
+    user = MOCK_USERS.get(request.username)
+    
+    # bcrypt is deliberately slow; keep it off the event loop
+    if not user or not await asyncio.to_thread(verify_password, request.password, user["hashed_password"]):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    access_token = create_access_token(
+        data={"sub": user["username"], "email": user["email"], "role": user["role"]}
+    )
+    
+    return TokenResponse(
+        access_token=access_token,
+        token_type="bearer",
+        user={
+            "username": user["username"],
+            "email": user["email"],
+            "role": user["role"]
+        }
+    )
 
 @router.get("/validate")
-async def validate_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def validate_token(user_data: Dict[str, Any] = Depends(get_current_user)):
     """Validate JWT token and return user info"""
-    try:
-        payload = jwt.decode(credentials.credentials, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
+    username: str = user_data.get("sub")
+    
+    if username is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
         
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-            
-        user = MOCK_USERS.get(username)
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-            
-        return {
-            "username": user["username"],
-            "email": user["email"], 
-            "role": user["role"]
-        }
+    user = MOCK_USERS.get(username)
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
         
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    return {
+        "username": user["username"],
+        "email": user["email"], 
+        "role": user["role"]
+    }
 
 @router.post("/logout")
 async def logout():
@@ -1,55 +1,40 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.security import HTTPBearer
+from fastapi import APIRouter, Depends
 from typing import Dict, Any
-import structlog
+import logging
 
-from app.utils.security import verify_token
+from app.deps import get_current_user
 
-logger = structlog.get_logger()
+logger = logging.getLogger(__name__)
 router = APIRouter()
-security = HTTPBearer()
 
 @router.post("/generate")
 async def generate_report(
     request: Dict[str, Any],
-    token: str = Depends(security)
+    user_data: Dict[str, Any] = Depends(get_current_user)
 ):
     """Generate audit report"""
-    try:
-        user_data = verify_token(token.credentials)
-        session_id = request.get("session_id")
-        report_type = request.get("report_type", "dashboard")
-        
-        # For now, return a mock response
-        # In production, this would integrate with the report service
-        return {
-            "report_id": f"report_{session_id}_{report_type}",
-            "status": "generated",
-            "download_url": f"/api/reports/report_{session_id}_{report_type}/download"
-        }
-        
-    except Exception as e:
-        logger.error("Report generation failed", error=str(e))
-        raise HTTPException(status_code=500, detail=str(e))
+    session_id = request.get("session_id")
+    report_type = request.get("report_type", "dashboard")
+    
+    # For now, return a mock response
+    # In production, this would integrate with the report service
+    return {
+        "report_id": f"report_{session_id}_{report_type}",
+        "status": "generated",
+        "download_url": f"/api/reports/report_{session_id}_{report_type}/download"
+    }
 
 @router.get("/{report_id}")
 async def get_report(
     report_id: str,
-    token: str = Depends(security)
+    user_data: Dict[str, Any] = Depends(get_current_user)
 ):
     """Get report details"""
-    try:
-        user_data = verify_token(token.credentials)
-        
-        # Mock response - replace with actual report retrieval
-        return {
-            "id": report_id,
-            "status": "completed",
-            "created_date": "2024-01-01T00:00:00Z",
-            "report_type": "dashboard",
-            "download_url": f"/api/reports/{report_id}/download"
-        }
-        
-    except Exception as e:
-        logger.error("Failed to get report", report_id=report_id, error=str(e))
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    # Mock response - replace with actual report retrieval
+    return {
+        "id": report_id,
+        "status": "completed",
+        "created_date": "2024-01-01T00:00:00Z",
+        "report_type": "dashboard",
+        "download_url": f"/api/reports/{report_id}/download"
+    }
@@ -1,55 +1,67 @@
 from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, BackgroundTasks
-from fastapi.security import HTTPBearer
-from typing import List, Dict, Any
+from fastapi.responses import ORJSONResponse
+from typing import List, Dict, Any, Tuple
 import aiofiles
+import asyncio
+import hashlib
 import os
 import uuid
-import structlog
+import logging
 from datetime import datetime
 
-from app.config import settings
+from app.config import ComprehensiveSettings, get_settings, MAX_FILE_SIZE, UPLOAD_DIR
 from app.services.pdf_service import pdf_service
 from app.services.excel_service import excel_service
 from app.services.ai_service import ai_service
 from app.database.database import get_db
-from app.utils.security import verify_token
-from app.utils.metrics import track_operation
+from app.models.document import Document, DocumentType
+from app.deps import get_current_user
+from app.utils.metrics import track_operation, record_in_background
 import time
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-logger = structlog.get_logger()
-router = APIRouter()
-security = HTTPBearer()
+logger = logging.getLogger(__name__)
+router = APIRouter(default_response_class=ORJSONResponse)
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+PDF_CONTENT_TYPES = frozenset({"application/pdf"})
+EXCEL_CONTENT_TYPES = frozenset({
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.ms-excel"
+})
+CONTENT_TYPE_BUCKETS = {
+    **dict.fromkeys(PDF_CONTENT_TYPES, DocumentType.PDF),
+    **dict.fromkeys(EXCEL_CONTENT_TYPES, DocumentType.EXCEL)
+}
 
 @router.post("/documents")
 async def upload_documents(
     files: List[UploadFile] = File(...),
     background_tasks: BackgroundTasks = None,
-    token: str = Depends(security),
-    db = Depends(get_db)
+    user_data: Dict[str, Any] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Upload PDF and Excel documents"""
-    start_time = time.time()
+    start_time = time.perf_counter()
     session_id = str(uuid.uuid4())
     
     try:
         # Verify authentication
-        user_data = verify_token(token.credentials)
         user_id = user_data["sub"]
         
         # Validate files
-        pdf_files = []
-        excel_files = []
-        
-        from app.models.document import DocumentType
+        files_by_type = {DocumentType.PDF: [], DocumentType.EXCEL: []}
         
         for file in files:
-            if file.content_type == "application/pdf":
-                pdf_files.append(file)
-            elif file.content_type in ["application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "application/vnd.ms-excel"]:
-                excel_files.append(file)
-            else:
-                # Fixed syntax error: use detail parameter correctly
+            doc_type = CONTENT_TYPE_BUCKETS.get(file.content_type)
+            if doc_type is None:
                 raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}")
+            files_by_type[doc_type].append(file)
+        
+        pdf_files = files_by_type[DocumentType.PDF]
+        excel_files = files_by_type[DocumentType.EXCEL]
         
         if len(pdf_files) != 1:
             raise HTTPException(status_code=400, detail="Exactly one PDF file is required")
@@ -79,8 +91,8 @@ async def upload_documents(
                 session_id
             )
         
-        latency = (time.time() - start_time) * 1000
-        await track_operation("upload", latency, True, session_id)
+        latency = (time.perf_counter() - start_time) * 1000
+        record_in_background(track_operation("upload", latency, True, session_id))
         
         return {
             "session_id": session_id,
@@ -88,78 +100,108 @@ async def upload_documents(
             "message": "Files uploaded successfully. Processing started in background."
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
-        latency = (time.time() - start_time) * 1000
-        await track_operation("upload", latency, False, session_id, str(e))
-        logger.error("Upload failed", error=str(e), session_id=session_id)
+        latency = (time.perf_counter() - start_time) * 1000
+        record_in_background(track_operation("upload", latency, False, session_id, str(e)))
+        logger.error("Upload failed for session %s: %s", session_id, e)
         raise HTTPException(status_code=500, detail=str(e))
 
-async def _process_uploaded_file(file: UploadFile, user_id: str, doc_type, db) -> Dict[str, Any]:
+async def _process_uploaded_file(file: UploadFile, user_id: str, doc_type, db: AsyncSession) -> Dict[str, Any]:
     """Process and save an uploaded file"""
     # Generate unique filename
     file_id = str(uuid.uuid4())
     file_extension = os.path.splitext(file.filename)[1]
     unique_filename = f"{file_id}{file_extension}"
-    file_path = os.path.join(settings.UPLOAD_DIR, unique_filename)
+    file_path = os.path.join(UPLOAD_DIR, unique_filename)
     
-    # Save file
+    # Stream file to disk in fixed-size chunks instead of buffering it whole,
+    # hashing as we go so re-uploads of the same content can be detected
+    file_size = 0
+    content_hash = hashlib.sha256()
     async with aiofiles.open(file_path, 'wb') as f:
-        content = await file.read()
-        await f.write(content)
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > MAX_FILE_SIZE:
+                break
+            await f.write(chunk)
+            content_hash.update(chunk)
+    if file_size > MAX_FILE_SIZE:
+        os.remove(file_path)
+        raise HTTPException(
+            status_code=413,
+            detail=f"{file.filename} exceeds the {MAX_FILE_SIZE // (1024 * 1024)}MB upload limit"
+        )
+    content_sha256 = content_hash.hexdigest()
+    
+    # Reuse the existing record if this user already uploaded identical content
+    existing = (await db.execute(
+        select(Document).where(
+            Document.user_id == user_id,
+            Document.content_sha256 == content_sha256
+        ).limit(1)
+    )).scalar_one_or_none()
+    
+    if existing:
+        os.remove(file_path)
+        logger.info("Duplicate upload of %s matched document %s", file.filename, existing.id)
+        return _document_summary(existing)
     
     # Create database record
-    from app.models.document import Document
     document = Document(
         filename=file.filename,
         file_path=file_path,
         file_type=file.content_type,
-        file_size=len(content),
+        file_size=file_size,
+        content_sha256=content_sha256,
         user_id=user_id,
         document_type=doc_type,
         processing_status="uploaded"
     )
     
     db.add(document)
-    db.commit()
-    db.refresh(document)
+    await db.commit()
+    await db.refresh(document)
     
+    return _document_summary(document)
+
+def _document_summary(document: Document) -> Dict[str, Any]:
+    """Upload response entry for a stored document"""
     return {
         "id": document.id,
         "filename": document.filename,
         "document_type": document.document_type,
         "file_size": document.file_size,
-        "upload_date": document.upload_date.isoformat(),
+        "upload_date": document.upload_date,
         "processing_status": document.processing_status
     }
 
 async def _process_documents_background(pdf_doc_id: int, excel_doc_ids: List[int], session_id: str):
     """Background task to process documents and extract data"""
     try:
-        logger.info("Starting background document processing", 
-                   pdf_doc_id=pdf_doc_id, 
-                   excel_doc_ids=excel_doc_ids,
-                   session_id=session_id)
+        logger.info("Starting background document processing for session %s (pdf=%s, excel=%s)",
+                    session_id, pdf_doc_id, excel_doc_ids)
         
         # This would integrate with your database and services
         # Implementation details would depend on your specific database setup
         
     except Exception as e:
-        logger.error("Background processing failed", error=str(e), session_id=session_id)
+        logger.error("Background processing failed for session %s: %s", session_id, e)
 
 @router.get("/documents/{document_id}/status")
 async def get_document_status(
     document_id: int,
-    token: str = Depends(security),
-    db = Depends(get_db)
+    user_data: Dict[str, Any] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get processing status of a document"""
-    user_data = verify_token(token.credentials)
-    
-    from app.models.document import Document
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == user_data["sub"]
-    ).first()
+    document = (await db.execute(
+        select(Document).where(
+            Document.id == document_id,
+            Document.user_id == user_data["sub"]
+        )
+    )).scalar_one_or_none()
     
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
@@ -171,57 +213,76 @@ async def get_document_status(
         "extraction_data": document.extraction_data
     }
 
+async def _extract_pdf(file_path: str, ai_semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """Extract text from a PDF and run AI extraction on it"""
+    async with aiofiles.open(file_path, 'rb') as f:
+        pdf_content = await f.read()
+    
+    # AI extraction works from the text alone, so skip rendering images and
+    # stream the pages rather than building the full layout
+    pdf_text = await pdf_service.extract_text(pdf_content)
+    async with ai_semaphore:
+        return await ai_service.extract_pdf_content(pdf_text)
+
+async def _extract_excel(file_path: str, ai_semaphore: asyncio.Semaphore) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Extract raw workbook data and run AI extraction on it"""
+    async with aiofiles.open(file_path, 'rb') as f:
+        excel_content = await f.read()
+    
+    excel_data = await excel_service.extract_data(excel_content)
+    async with ai_semaphore:
+        ai_excel_data = await ai_service.extract_excel_content(excel_data)
+    return excel_data, ai_excel_data
+
 @router.post("/extract")
 async def extract_document_data(
     request: Dict[str, Any],
-    token: str = Depends(security),
-    db = Depends(get_db)
+    user_data: Dict[str, Any] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    settings: ComprehensiveSettings = Depends(get_settings)
 ):
     """Extract data from uploaded documents"""
-    start_time = time.time()
+    start_time = time.perf_counter()
     session_id = str(uuid.uuid4())
     
     try:
-        user_data = verify_token(token.credentials)
         pdf_doc_id = request.get("pdf_document_id")
         excel_doc_ids = request.get("excel_document_ids", [])
         
-        # Get documents
-        from app.models.document import Document
-        pdf_doc = db.query(Document).filter(
-            Document.id == pdf_doc_id,
-            Document.user_id == user_data["sub"]
-        ).first()
+        # Load the PDF and all Excel documents in one query; the session must not be shared across tasks
+        docs_by_id = {
+            doc.id: doc
+            for doc in (await db.execute(
+                select(Document).where(
+                    Document.id.in_([pdf_doc_id, *excel_doc_ids]),
+                    Document.user_id == user_data["sub"]
+                )
+            )).scalars()
+        }
+        pdf_doc = docs_by_id.get(pdf_doc_id)
         
         if not pdf_doc:
             raise HTTPException(status_code=404, detail="PDF document not found")
         
-        # Extract PDF data
-        with open(pdf_doc.file_path, 'rb') as f:
-            pdf_content = f.read()
+        excel_docs = [docs_by_id[excel_id] for excel_id in excel_doc_ids if excel_id in docs_by_id]
         
-        pdf_text, pdf_images = await pdf_service.extract_text_and_images(pdf_content)
-        pdf_extracted_data = await ai_service.extract_pdf_content(pdf_text, pdf_images)
+        # Extract PDF and Excel data concurrently, bounded by the AI concurrency limit
+        ai_semaphore = asyncio.Semaphore(settings.max_concurrent_ai_requests)
+        pdf_extracted_data, *excel_results = await asyncio.gather(
+            _extract_pdf(pdf_doc.file_path, ai_semaphore),
+            *(_extract_excel(excel_doc.file_path, ai_semaphore) for excel_doc in excel_docs)
+        )
         
-        # Extract Excel data
         excel_extracted_data = {}
-        for excel_id in excel_doc_ids:
-            excel_doc = db.query(Document).filter(
-                Document.id == excel_id,
-                Document.user_id == user_data["sub"]
-            ).first()
-            
-            if excel_doc:
-                with open(excel_doc.file_path, 'rb') as f:
-                    excel_content = f.read()
-                
-                excel_data = await excel_service.extract_data(excel_content)
-                ai_excel_data = await ai_service.extract_excel_content(excel_data)
-                excel_extracted_data[excel_doc.filename] = {
-                    "document_id": excel_id,
-                    "raw_data": excel_data,
-                    "ai_analysis": ai_excel_data
-                }
+        for excel_doc, (excel_data, ai_excel_data) in zip(excel_docs, excel_results):
+            extraction = {
+                "document_id": excel_doc.id,
+                "raw_data": excel_data,
+                "ai_analysis": ai_excel_data
+            }
+            excel_extracted_data[excel_doc.filename] = extraction
+            excel_doc.extraction_data = extraction
+            excel_doc.processing_status = "extracted"
         
         # Generate mapping suggestions
         mapping_suggestions = await ai_service.suggest_mappings(pdf_extracted_data, excel_extracted_data)
@@ -230,16 +291,10 @@ async def extract_document_data(
         pdf_doc.extraction_data = pdf_extracted_data
         pdf_doc.processing_status = "extracted"
         
-        for excel_id in excel_doc_ids:
-            excel_doc = db.query(Document).filter(Document.id == excel_id).first()
-            if excel_doc and excel_doc.filename in excel_extracted_data:
-                excel_doc.extraction_data = excel_extracted_data[excel_doc.filename]
-                excel_doc.processing_status = "extracted"
-        
-        db.commit()
+        await db.commit()
         
-        latency = (time.time() - start_time) * 1000
-        await track_operation("extraction", latency, True, session_id)
+        latency = (time.perf_counter() - start_time) * 1000
+        record_in_background(track_operation("extraction", latency, True, session_id))
         
         return {
             "session_id": session_id,
@@ -248,8 +303,10 @@ async def extract_document_data(
             "mapping_suggestions": mapping_suggestions
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
-        latency = (time.time() - start_time) * 1000
-        await track_operation("extraction", latency, False, session_id, str(e))
-        logger.error("Extraction failed", error=str(e))
+        latency = (time.perf_counter() - start_time) * 1000
+        record_in_background(track_operation("extraction", latency, False, session_id, str(e)))
+        logger.error("Extraction failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
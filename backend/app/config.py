@@ -1,15 +1,22 @@
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from functools import cached_property, lru_cache
 from typing import Optional
 import os
 
 class Settings(BaseSettings):
     # Database
     DATABASE_URL: str = "sqlite:///./veritas_enhanced.db"
+    DOCUMENTS_DATABASE_URL: str = "sqlite:///./veritas.db"  # app.database's own document/upload-session store
+    DB_POOL_SIZE: int = 10  # Long-lived connections kept open across requests
+    DB_MAX_OVERFLOW: int = 5
+    DB_POOL_TIMEOUT: int = 30  # Seconds to wait for a free connection before failing
+    DB_POOL_RECYCLE: int = 1800  # Replace connections older than this many seconds
     
     # Security
     SECRET_KEY: str = "your-secret-key-change-in-production"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    JWT_CACHE_TTL_SECONDS: int = 30  # Reuse verified token payloads for this long
     
     # AI Services
     GOOGLE_API_KEY: Optional[str] = None
@@ -87,32 +94,56 @@ class Settings(BaseSettings):
     MOCK_AI_RESPONSES: bool = False  # For testing without AI API
     ENABLE_DEBUG_ENDPOINTS: bool = False
     
-    class Config:
-        env_file = ".env"
-        extra = "ignore"  # Ignore extra fields
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        extra="ignore",  # Ignore extra fields
+        frozen=True,  # Settings are read-only once loaded, so derived values can be cached
+        validate_assignment=False
+    )
+
+# Async drivers for the DATABASE_URL schemes we support
+ASYNC_DATABASE_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def to_async_database_url(database_url: str) -> str:
+    """A database URL mapped onto its async driver (aiosqlite / asyncpg)"""
+    scheme, sep, rest = database_url.partition("://")
+    return f"{ASYNC_DATABASE_DRIVERS.get(scheme, scheme)}{sep}{rest}"
 
 # Settings validation and computed properties
 class ComprehensiveSettings(Settings):
     """Extended settings with computed properties for comprehensive processing"""
     
-    @property
+    @cached_property
+    def async_database_url(self) -> str:
+        """DATABASE_URL mapped onto its async driver (aiosqlite / asyncpg)"""
+        return to_async_database_url(self.DATABASE_URL)
+    
+    @cached_property
+    def async_documents_database_url(self) -> str:
+        """DOCUMENTS_DATABASE_URL mapped onto its async driver"""
+        return to_async_database_url(self.DOCUMENTS_DATABASE_URL)
+    
+    @cached_property
     def is_comprehensive_mode(self) -> bool:
         """Check if comprehensive extraction is enabled"""
         return self.enable_comprehensive_extraction and self.enhancement_level == "comprehensive"
     
-    @property
+    @cached_property
     def effective_ai_timeout(self) -> int:
         """Get effective AI timeout based on comprehensive mode"""
         if self.is_comprehensive_mode:
             return max(self.ai_processing_timeout, 600)  # Minimum 10 minutes for comprehensive
         return self.ai_processing_timeout
     
-    @property
+    @cached_property
     def max_total_cells_to_process(self) -> int:
         """Calculate maximum total cells that can be processed"""
         return self.max_sheets_per_workbook * self.max_rows_per_sheet * self.max_cols_per_sheet
     
-    @property
+    @cached_property
     def gemini_api_settings(self) -> dict:
         """Get optimized Gemini API settings for comprehensive processing"""
         return {
@@ -135,11 +166,29 @@ class ComprehensiveSettings(Settings):
             "ai_timeout_seconds": self.effective_ai_timeout
         }
 
-settings = ComprehensiveSettings()
+@lru_cache(maxsize=1)
+def get_settings() -> ComprehensiveSettings:
+    """Load settings once per process"""
+    return ComprehensiveSettings()
+
+# Settings read on hot paths (e.g. every upload chunk). On first access they are
+# copied onto the module as plain constants, so later reads skip the model.
+HOT_PATH_SETTINGS = frozenset({"MAX_FILE_SIZE", "UPLOAD_DIR"})
+
+def __getattr__(name: str):
+    # `from app.config import settings` keeps working, but nothing is loaded
+    # until the first module that actually needs settings asks for them
+    if name == "settings":
+        return get_settings()
+    if name in HOT_PATH_SETTINGS:
+        value = globals()[name] = getattr(get_settings(), name)
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Log the comprehensive settings on startup
 def log_comprehensive_settings():
     """Log comprehensive processing settings for verification"""
+    settings = get_settings()
     import structlog
     logger = structlog.get_logger()
     
@@ -153,6 +202,7 @@ def log_comprehensive_settings():
 # Environment variable validation
 def validate_comprehensive_settings():
     """Validate that all required settings are properly configured"""
+    settings = get_settings()
     import structlog
     logger = structlog.get_logger()
     
@@ -181,8 +231,3 @@ def validate_comprehensive_settings():
         logger.info("✅ Comprehensive extraction configuration validated successfully")
     
     return len(issues) == 0
-
-# Initialize on import
-if __name__ != "__main__":
-    log_comprehensive_settings()
-    validate_comprehensive_settings()
\ No newline at end of file
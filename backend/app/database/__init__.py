@@ -1,12 +1,77 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Float
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from datetime import datetime
-
-# Database setup
-DATABASE_URL = "sqlite:///./veritas.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+from sqlalchemy import event, insert, literal, select, func, bindparam, text, Column, Index, MetaData, Table, Integer, String, DateTime
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from cachetools import TTLCache
+from typing import Dict
+import hashlib
+import os
+import structlog
+import threading
+
+from app.config import get_settings
+
+logger = structlog.get_logger()
+
+# Applied once per pooled connection: WAL lets readers run alongside the writer,
+# synchronous=NORMAL skips the per-commit fsync WAL does not need
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+)
+
+def _set_sqlite_pragma(dbapi_conn, conn_record):
+    cursor = dbapi_conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+# Database setup. This module keeps documents and upload sessions in its own
+# database (DOCUMENTS_DATABASE_URL); its models do not describe the main app's
+# tables. Engines are created lazily and per process, so a server that forks
+# workers after importing this module never shares a connection pool.
+_engines: Dict[int, AsyncEngine] = {}
+_engines_lock = threading.Lock()
+
+def get_engine() -> AsyncEngine:
+    pid = os.getpid()
+    engine = _engines.get(pid)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(pid)
+            if engine is None:
+                settings = get_settings()
+                database_url = settings.async_documents_database_url
+                is_sqlite = database_url.startswith("sqlite")
+                engine = create_async_engine(
+                    database_url,
+                    connect_args={"check_same_thread": False, "timeout": 30} if is_sqlite else {},
+                    poolclass=AsyncAdaptedQueuePool,
+                    pool_size=settings.DB_POOL_SIZE,
+                    max_overflow=settings.DB_MAX_OVERFLOW,
+                    pool_timeout=settings.DB_POOL_TIMEOUT,
+                    pool_pre_ping=True,
+                    pool_recycle=settings.DB_POOL_RECYCLE,
+                    query_cache_size=1200
+                )
+                if is_sqlite:
+                    event.listen(engine.sync_engine, "connect", _set_sqlite_pragma)
+                _engines[pid] = engine
+    return engine
+
+async def dispose_engine():
+    """Close this process's pool, if one was ever opened"""
+    engine = _engines.pop(os.getpid(), None)
+    if engine is not None:
+        await engine.dispose()
+
+# Unbound; each session is bound to this process's engine when it is opened
+AsyncSessionLocal = async_sessionmaker(class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 # Database Models
@@ -14,73 +79,184 @@ class Document(Base):
     __tablename__ = "documents"
     
     id = Column(Integer, primary_key=True, index=True)
-    file_id = Column(String, unique=True, index=True)  # UUID for file
+    file_id = Column(String(36), unique=True, index=True)  # UUID for file
     filename = Column(String, nullable=False)
     file_path = Column(String, nullable=False)
     content_type = Column(String, nullable=False)
     file_size = Column(Integer, nullable=False)
     document_type = Column(String, nullable=False)  # 'pdf' or 'excel'
-    session_id = Column(String, index=True)  # Group related documents
-    upload_date = Column(DateTime, default=datetime.utcnow)
+    session_id = Column(String(36), index=True)  # Group related documents
+    upload_date = Column(DateTime, server_default=func.current_timestamp(), nullable=False)
     processing_status = Column(String, default="uploaded")  # uploaded, processing, completed, failed
+    
+    __table_args__ = (
+        Index("ix_documents_upload_date_desc", upload_date.desc()),  # recent uploads
+        Index("ix_documents_type_date", document_type, upload_date),  # per-type counts
+    )
+    __mapper_args__ = {"eager_defaults": True}  # fetch server defaults via RETURNING
 
 class UploadSession(Base):
     __tablename__ = "upload_sessions"
     
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String, unique=True, index=True)
+    session_id = Column(String(36), unique=True, index=True)
     pdf_count = Column(Integer, default=0)
     excel_count = Column(Integer, default=0)
     total_files = Column(Integer, default=0)
     total_size = Column(Integer, default=0)  # bytes
-    created_date = Column(DateTime, default=datetime.utcnow)
+    created_date = Column(DateTime, server_default=func.current_timestamp(), nullable=False)
     status = Column(String, default="active")  # active, completed, failed
+    
+    __mapper_args__ = {"eager_defaults": True}
+
+# Statements built once so repeat calls hit the compiled-statement cache
+_STMT_DOCS_BY_TYPE = select(Document.document_type, func.count()).group_by(Document.document_type)
+# Both exact counts in one round trip: per-type document rows plus one
+# row for the session total, tagged with the table name
+_SESSIONS_BUCKET = UploadSession.__tablename__
+_STMT_STATS_COUNTS = _STMT_DOCS_BY_TYPE.union_all(
+    select(literal(_SESSIONS_BUCKET), func.count()).select_from(UploadSession)
+)
+_STMT_TABLE_STAT = text("SELECT stat FROM sqlite_stat1 WHERE tbl = :tbl LIMIT 1")
+_STMT_RECENT = (
+    select(
+        Document.id,
+        Document.filename,
+        Document.document_type,
+        Document.file_size,
+        Document.upload_date,
+        Document.processing_status.label("status")  # rows already carry the response keys
+    )
+    .order_by(Document.upload_date.desc())
+    .limit(bindparam("lim"))
+)
+_STMT_DOCUMENT_BY_FILE_ID = select(Document.__table__).where(Document.file_id == bindparam("file_id"))
+
+# Dashboard counts change rarely; serve repeat polls from memory and drop the
+# cached value whenever a Document or UploadSession row is written
+_stats_cache = TTLCache(maxsize=16, ttl=15)
+_stats_cache_lock = threading.Lock()
+
+def _invalidate_stats_cache(*_):
+    with _stats_cache_lock:
+        _stats_cache.clear()
+
+for _model in (Document, UploadSession):
+    for _event in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _event, _invalidate_stats_cache)
+
+# Hot Document lookups by file_id, cached as plain dicts (never ORM instances,
+# which are bound to the session that loaded them)
+_document_cache = TTLCache(maxsize=1024, ttl=60)
+_document_cache_lock = threading.Lock()
+
+def _invalidate_document_cache(mapper, connection, target):
+    with _document_cache_lock:
+        _document_cache.pop(target.file_id, None)
+
+event.listen(Document, "after_update", _invalidate_document_cache)
+event.listen(Document, "after_delete", _invalidate_document_cache)
 
 # Database dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal(bind=get_engine()) as db:
         yield db
-    finally:
-        db.close()
+
+# Schema fingerprint, kept outside Base.metadata so it does not hash itself
+_schema_version = Table(
+    "schema_version", MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("fingerprint", String(40), nullable=False)
+)
+
+def _schema_fingerprint() -> str:
+    tables = sorted(
+        (table.name, tuple(column.name for column in table.columns), tuple(sorted(index.name for index in table.indexes)))
+        for table in Base.metadata.sorted_tables
+    )
+    return hashlib.sha1(repr(tables).encode()).hexdigest()
 
 # Initialize database
-def init_db():
-    Base.metadata.create_all(bind=engine)
-    print("Database initialized successfully!")
+async def init_db():
+    fingerprint = _schema_fingerprint()
+    async with get_engine().begin() as conn:
+        await conn.run_sync(_schema_version.create, checkfirst=True)
+        current = (await conn.execute(select(_schema_version.c.fingerprint))).scalar()
+        if current == fingerprint:
+            logger.info("Database schema unchanged, skipping create_all")
+            return
+        
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(
+            text("REPLACE INTO schema_version (id, fingerprint) VALUES (1, :fingerprint)"),
+            {"fingerprint": fingerprint}
+        )
+    logger.info("Database initialized successfully", schema_fingerprint=fingerprint)
 
 # Database utility functions
-def get_document_stats():
-    db = SessionLocal()
-    try:
-        total_docs = db.query(Document).count()
-        pdf_count = db.query(Document).filter(Document.document_type == "pdf").count()
-        excel_count = db.query(Document).filter(Document.document_type == "excel").count()
-        total_sessions = db.query(UploadSession).count()
-        
-        return {
-            "total_documents": total_docs,
-            "pdf_documents": pdf_count,
-            "excel_documents": excel_count,
-            "total_sessions": total_sessions
-        }
-    finally:
-        db.close()
-
-def get_recent_uploads(limit=10):
-    db = SessionLocal()
+async def _approximate_row_count(db, table_name):
+    """Row count recorded by the last ANALYZE, or None if there is no estimate"""
     try:
-        documents = db.query(Document).order_by(Document.upload_date.desc()).limit(limit).all()
-        return [
-            {
-                "id": doc.id,
-                "filename": doc.filename,
-                "document_type": doc.document_type,
-                "file_size": doc.file_size,
-                "upload_date": doc.upload_date.isoformat(),
-                "status": doc.processing_status
-            }
-            for doc in documents
-        ]
-    finally:
-        db.close()
\ No newline at end of file
+        stat = (await db.execute(_STMT_TABLE_STAT, {"tbl": table_name})).scalar()
+    except OperationalError:  # sqlite_stat1 does not exist until ANALYZE has run
+        return None
+    return int(stat.split()[0]) if stat else None
+
+async def get_document_stats(exact=True):
+    cache_key = ("document_stats", exact)
+    with _stats_cache_lock:
+        stats = _stats_cache.get(cache_key)
+    if stats is not None:
+        return stats
+    
+    async with AsyncSessionLocal(bind=get_engine()) as db:
+        # Per-type counts come off the covering type/date index either way
+        total_sessions = None if exact else await _approximate_row_count(db, UploadSession.__tablename__)
+        if total_sessions is None:
+            counts_by_type = dict((await db.execute(_STMT_STATS_COUNTS)).all())
+            total_sessions = counts_by_type.pop(_SESSIONS_BUCKET)
+        else:
+            counts_by_type = dict((await db.execute(_STMT_DOCS_BY_TYPE)).all())
+    
+    stats = {
+        "total_documents": sum(counts_by_type.values()),
+        "pdf_documents": counts_by_type.get("pdf", 0),
+        "excel_documents": counts_by_type.get("excel", 0),
+        "total_sessions": total_sessions
+    }
+    with _stats_cache_lock:
+        _stats_cache[cache_key] = stats
+    return stats
+
+async def get_recent_uploads(limit=10):
+    # Plain rows rather than ORM objects; the selected columns are labelled with
+    # the response keys, so each mapping converts straight to a dict.
+    # upload_date stays a datetime - the response encoder serializes it.
+    async with AsyncSessionLocal(bind=get_engine()) as db:
+        rows = (await db.execute(_STMT_RECENT, {"lim": limit})).mappings().all()
+    return list(map(dict, rows))
+
+async def get_document_by_file_id(file_id):
+    with _document_cache_lock:
+        document = _document_cache.get(file_id)
+    if document is not None:
+        return document
+    
+    async with AsyncSessionLocal(bind=get_engine()) as db:
+        row = (await db.execute(_STMT_DOCUMENT_BY_FILE_ID, {"file_id": file_id})).mappings().one_or_none()
+    if row is None:
+        return None
+    
+    document = dict(row)
+    with _document_cache_lock:
+        _document_cache[file_id] = document
+    return document
+
+async def bulk_insert_documents(rows):
+    """Insert many Document rows (plain dicts) in one transaction"""
+    if not rows:
+        return
+    async with get_engine().begin() as conn:
+        await conn.execute(insert(Document), rows)
+    # Core inserts skip the mapper events that normally invalidate the stats cache
+    _invalidate_stats_cache()
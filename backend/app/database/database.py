@@ -1,32 +1,111 @@
-from sqlalchemy import create_engine
+from contextlib import asynccontextmanager, suppress
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import asyncio
 import structlog
 
 from app.config import settings
+from app.database import _set_sqlite_pragma, dispose_engine
 
 logger = structlog.get_logger()
 
-# Create database engine
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
+ASYNC_DATABASE_URL = settings.async_database_url
+
+# Create database engine. The pool keeps connections (and SQLite's per-connection
+# page cache) alive across requests instead of reopening the file every time.
+engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    connect_args={"check_same_thread": False} if "sqlite" in ASYNC_DATABASE_URL else {},
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=True
 )
+if "sqlite" in ASYNC_DATABASE_URL:
+    # WAL and the cache/mmap sizes, on every pooled connection
+    event.listen(engine.sync_engine, "connect", _set_sqlite_pragma)
 
 # Create sessionmaker
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 # Create base class for models
 Base = declarative_base()
 
-def get_db():
+def upgrade_existing_tables(connection):
+    """Add model columns and indexes that an existing table predates.
+
+    create_all only creates whole tables, so a column added to a model later is
+    added here with ALTER TABLE; SQLite can only add nullable columns that way.
+    """
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            existing.add(column.name)
+            logger.info("Added missing column", table=table.name, column=column.name)
+        for index in table.indexes:
+            if all(column.name in existing for column in index.columns):
+                index.create(connection, checkfirst=True)
+
+async def get_db():
     """Database session dependency"""
-    db = SessionLocal()
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except Exception as e:
+            # Routes also end the session with HTTPException; only log real database failures
+            if isinstance(e, SQLAlchemyError):
+                logger.error("Database session error", error=str(e))
+            await db.rollback()
+            raise
+
+# Planner statistics. A plain ANALYZE refreshes sqlite_stat1 for every table in
+# the file; PRAGMA optimize is cheap and usually a no-op.
+ANALYZE_INTERVAL_SECONDS = 7 * 24 * 60 * 60
+
+async def optimize_db(analyze=False):
+    if engine.dialect.name != "sqlite":
+        return
+    async with engine.begin() as conn:
+        if analyze:
+            await conn.execute(text("ANALYZE"))
+        await conn.execute(text("PRAGMA optimize"))
+    logger.info("Database optimized", analyze=analyze)
+
+async def run_db_maintenance(interval=ANALYZE_INTERVAL_SECONDS):
+    """Re-ANALYZE on a fixed interval until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await optimize_db(analyze=True)
+        except OperationalError as e:  # e.g. database locked; try again next round
+            logger.warning("Database maintenance failed", error=str(e))
+
+@asynccontextmanager
+async def lifespan(app):
+    """Warm the connection pool on startup and release it on shutdown"""
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT 1"))
+        await conn.run_sync(upgrade_existing_tables)
+    logger.info("Database pool ready", pool_size=settings.DB_POOL_SIZE)
+    maintenance = asyncio.create_task(run_db_maintenance())
     try:
-        yield db
-    except Exception as e:
-        logger.error("Database session error", error=str(e))
-        db.rollback()
-        raise
+        yield
     finally:
-        db.close()
\ No newline at end of file
+        maintenance.cancel()
+        with suppress(asyncio.CancelledError):
+            await maintenance
+        # SQLite recommends PRAGMA optimize just before closing connections
+        await optimize_db()
+        await engine.dispose()
+        await dispose_engine()
+        logger.info("Database pool disposed")
@@ -0,0 +1,12 @@
+from fastapi import Depends
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from typing import Any, Dict
+
+from app.utils.security import verify_token
+
+# Shared bearer scheme so every router resolves the same dependency
+security = HTTPBearer(auto_error=True)
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
+    """Resolve the bearer token to its payload once per request"""
+    return verify_token(credentials.credentials)
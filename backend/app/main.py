@@ -1,20 +1,23 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request, status, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, JSON, Float
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import event, select, func, Column, Index, Integer, String, DateTime, Text, JSON, Float
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import declarative_base, deferred
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional, Dict, Any, Tuple
+from datetime import datetime
 import os
 import uuid
-import shutil
-import jwt
 import hashlib
+import hmac
+import threading
 import json
 import asyncio
+import aiofiles
 import structlog
 import base64
 from PIL import Image
@@ -24,19 +27,23 @@ import io
 from app.services.enhanced_ai_service import enhanced_gemini_service
 from app.services.excel_service import excel_service  # This now uses ComprehensiveExcelService
 from decouple import config
+from cachetools import TTLCache
+from contextlib import asynccontextmanager
 
 # Import comprehensive configuration
 from app.config import settings, log_comprehensive_settings, validate_comprehensive_settings
+from app.database.database import AsyncSessionLocal, engine, get_db, lifespan as database_lifespan
+from app.deps import security
+from app.utils.concurrency import run_mupdf
+from app.utils.security import create_access_token, get_password_hash, verify_password, verify_token as verify_access_token
 
 # Logging setup
 logger = structlog.get_logger()
 
 # Configuration - now uses comprehensive settings
 UPLOAD_DIR = settings.UPLOAD_DIR
-DATABASE_URL = settings.DATABASE_URL
 SECRET_KEY = settings.SECRET_KEY
-ALGORITHM = settings.ALGORITHM
-ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 # Create upload directory
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -45,39 +52,27 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 log_comprehensive_settings()
 validate_comprehensive_settings()
 
-# Authentication utilities (unchanged)
-def hash_password(password: str) -> str:
+# Authentication utilities
+def legacy_password_hash(password: str) -> str:
+    """Unsalted SHA-256 that user rows carried before bcrypt"""
     return hashlib.sha256((password + SECRET_KEY).encode()).hexdigest()
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return hash_password(plain_password) == hashed_password
-
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+def check_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """(matches, bcrypt hash to store instead) - legacy rows are upgraded on their next login"""
+    if not hashed_password.startswith("$2"):
+        if hmac.compare_digest(legacy_password_hash(plain_password), hashed_password):
+            return True, get_password_hash(plain_password)
+        return False, None
+    return verify_password(plain_password, hashed_password), None
 
 def verify_token(credentials: HTTPAuthorizationCredentials) -> dict:
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
-        return payload
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
-    except jwt.JWTError:
+    # Signature checks and recently verified tokens are handled by the shared helper
+    payload = verify_access_token(credentials.credentials)
+    if payload.get("sub") is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    return payload
 
-# Database setup
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Database setup - sessions come from the shared async engine
 Base = declarative_base()
 
 # Enhanced Database Models (unchanged but documented)
@@ -95,10 +90,17 @@ class Document(Base):
     user_id = Column(String, index=True)
     upload_date = Column(DateTime, default=datetime.utcnow)
     processing_status = Column(String, default="uploaded")
-    extracted_data = Column(JSON, nullable=True, default=None)
-    comprehensive_analysis = Column(JSON, nullable=True, default=None)  # For comprehensive extraction
-    extraction_metadata = Column(JSON, nullable=True, default=None)     # For extraction statistics
+    # Whole-document extraction JSON, often megabytes: written by processing but
+    # never read back through Document, so loading a row skips it. raiseload
+    # turns an accidental read into an error instead of a hidden extra query
+    extracted_data = deferred(Column(JSON, nullable=True, default=None), raiseload=True)
+    comprehensive_analysis = deferred(Column(JSON, nullable=True, default=None), raiseload=True)  # For comprehensive extraction
+    extraction_metadata = deferred(Column(JSON, nullable=True, default=None), raiseload=True)     # For extraction statistics
     processed_date = Column(DateTime, nullable=True, default=None)
+    
+    __table_args__ = (
+        Index("ix_documents_user_type", user_id, document_type),  # per-user stats counts
+    )
 
 class EnhancedUploadSession(Base):
     __tablename__ = "enhanced_upload_sessions"
@@ -148,61 +150,104 @@ class DirectAuditSession(Base):
     # New field for comprehensive audit metadata
     comprehensive_audit_metadata = Column(JSON, nullable=True, default=None)
 
+# Authenticated users keyed by user_id, so repeat requests on a session skip the
+# users lookup. Plain tuples, never ORM instances (those belong to one session);
+# any write to a User row drops its entry.
+class CurrentUser(NamedTuple):
+    user_id: str
+    username: str
+    email: str
+    role: str
+
+_current_user_cache = TTLCache(maxsize=4096, ttl=60)
+_current_user_cache_lock = threading.Lock()
+
+def _invalidate_current_user(mapper, connection, target):
+    with _current_user_cache_lock:
+        _current_user_cache.pop(target.user_id, None)
+
+event.listen(User, "after_update", _invalidate_current_user)
+event.listen(User, "after_delete", _invalidate_current_user)
+
 # Initialize database
-try:
-    Base.metadata.create_all(bind=engine)
-    logger.info("Enhanced database initialized successfully")
-except Exception as e:
-    logger.error(f"Database initialization failed: {e}")
+def _create_missing_indexes(connection):
+    # create_all skips tables that already exist, indexes included, so
+    # indexes added to a model later have to be created on their own
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
 
-# Create default users (unchanged)
-def create_default_users():
-    db = SessionLocal()
+async def init_enhanced_db():
     try:
-        if db.query(User).count() == 0:
-            demo_user = User(
-                user_id=str(uuid.uuid4()),
-                username="demo",
-                email="demo@veritas.com",
-                hashed_password=hash_password("demo123"),
-                role="analyst"
-            )
-            admin_user = User(
-                user_id=str(uuid.uuid4()),
-                username="admin",
-                email="admin@veritas.com", 
-                hashed_password=hash_password("admin123"),
-                role="admin"
-            )
-            db.add(demo_user)
-            db.add(admin_user)
-            db.commit()
-            logger.info("Default users created successfully")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(_create_missing_indexes)
+        logger.info("Enhanced database initialized successfully")
     except Exception as e:
-        logger.error(f"Error creating users: {e}")
-    finally:
-        db.close()
+        logger.error(f"Database initialization failed: {e}")
 
-create_default_users()
+# Default accounts; bcrypt hashes are precomputed so startup does not pay for bcrypt rounds
+DEFAULT_USER_PASSWORDS = {
+    "demo": ("demo123", "$2b$12$Y0JRpIALldgc398YZ3/Y0u.mFt2I3jOMN.UXt95iSex4IEsUdw1ZS"),
+    "admin": ("admin123", "$2b$12$GV2sJPXLUcYV//UbDKl5X.2PbZQVPe0xdcLp/jAzj1DE2nbAXs4XK"),
+}
 
-# Database dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+async def create_default_users():
+    async with AsyncSessionLocal() as db:
+        try:
+            if await db.scalar(select(User.id).limit(1)) is not None:
+                # Rehash default accounts still stored with the legacy SHA-256 hash
+                for user in await db.scalars(select(User).where(User.username.in_(tuple(DEFAULT_USER_PASSWORDS)))):
+                    password, bcrypt_hash = DEFAULT_USER_PASSWORDS[user.username]
+                    if user.hashed_password == legacy_password_hash(password):
+                        user.hashed_password = bcrypt_hash
+                await db.commit()
+            else:
+                demo_user = User(
+                    user_id=str(uuid.uuid4()),
+                    username="demo",
+                    email="demo@veritas.com",
+                    hashed_password=DEFAULT_USER_PASSWORDS["demo"][1],
+                    role="analyst"
+                )
+                admin_user = User(
+                    user_id=str(uuid.uuid4()),
+                    username="admin",
+                    email="admin@veritas.com", 
+                    hashed_password=DEFAULT_USER_PASSWORDS["admin"][1],
+                    role="admin"
+                )
+                db.add(demo_user)
+                db.add(admin_user)
+                await db.commit()
+                logger.info("Default users created successfully")
+        except Exception as e:
+            logger.error(f"Error creating users: {e}")
 
-# Auth dependency
-security = HTTPBearer()
+@asynccontextmanager
+async def lifespan(app):
+    """Shared database lifespan plus this app's tables and default users"""
+    async with database_lifespan(app):
+        await init_enhanced_db()
+        await create_default_users()
+        yield
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+# Auth dependency
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_db)) -> CurrentUser:
     payload = verify_token(credentials)
     user_id = payload.get("sub")
     
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if user is None:
+    with _current_user_cache_lock:
+        user = _current_user_cache.get(user_id)
+    if user is not None:
+        return user
+    
+    row = await db.scalar(select(User).where(User.user_id == user_id))
+    if row is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    user = CurrentUser(row.user_id, row.username, row.email, row.role)
+    with _current_user_cache_lock:
+        _current_user_cache[user_id] = user
     return user
 
 # Pydantic models (unchanged)
@@ -219,7 +264,9 @@ class LoginResponse(BaseModel):
 app = FastAPI(
     title="Veritas AI Auditor - Comprehensive Direct Validation Edition",
     description="Advanced enterprise presentation validation with comprehensive extraction and 100% coverage",
-    version="13.0.0"  # Updated version for comprehensive features
+    version="13.0.0",  # Updated version for comprehensive features
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -231,6 +278,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Exception handlers - routes raise freely and errors are mapped here
+@app.exception_handler(IntegrityError)
+async def integrity_error_handler(request: Request, exc: IntegrityError):
+    logger.warning(f"Integrity error on {request.method} {request.url.path}: {exc.orig}")
+    return JSONResponse(status_code=status.HTTP_409_CONFLICT, content={"detail": "Conflicting record"})
+
+@app.exception_handler(SQLAlchemyError)
+async def database_error_handler(request: Request, exc: SQLAlchemyError):
+    logger.error(f"Database error on {request.method} {request.url.path}: {exc}")
+    return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"detail": "Database error"})
+
 # Mount static files
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
@@ -277,22 +335,26 @@ async def health_check():
             "max_cols_per_sheet": settings.max_cols_per_sheet,
             "excel_values_limit": settings.MAX_EXCEL_VALUES_IN_RESPONSE
         },
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": datetime.utcnow()
     }
 
 # Authentication (unchanged)
 @app.post("/api/auth/login", response_model=LoginResponse)
-async def login(request: LoginRequest, db: Session = Depends(get_db)):
+async def login(request: LoginRequest, db: AsyncSession = Depends(get_db)):
     """Enhanced authentication with detailed logging"""
     logger.info(f"Login attempt for user: {request.username}")
     
-    user = db.query(User).filter(User.username == request.username).first()
-    if not user or not verify_password(request.password, user.hashed_password):
+    user = await db.scalar(select(User).where(User.username == request.username))
+    # bcrypt is deliberately slow; keep it off the event loop
+    valid, upgraded_hash = await asyncio.to_thread(check_password, request.password, user.hashed_password) if user else (False, None)
+    if not valid:
         logger.warning(f"Failed login attempt for user: {request.username}")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     
+    if upgraded_hash:
+        user.hashed_password = upgraded_hash
     user.last_login = datetime.utcnow()
-    db.commit()
+    await db.commit()
     
     access_token = create_access_token(
         data={"sub": user.user_id, "username": user.username, "role": user.role}
@@ -312,12 +374,12 @@ async def login(request: LoginRequest, db: Session = Depends(get_db)):
     )
 
 @app.get("/api/auth/validate")
-async def validate_token(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+async def validate_token(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_db)):
     """Validate JWT token and return user info"""
     payload = verify_token(credentials)
     username = payload.get("username")
     
-    user = db.query(User).filter(User.username == username).first()
+    user = await db.scalar(select(User).where(User.username == username))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -327,8 +389,8 @@ async def validate_token(credentials: HTTPAuthorizationCredentials = Depends(sec
 @app.post("/api/upload/documents")
 async def upload_documents_enhanced(
     files: List[UploadFile] = File(...), 
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Enhanced document upload with comprehensive validation"""
     logger.info(f"Comprehensive upload started by user: {current_user.username}")
@@ -365,10 +427,13 @@ async def upload_documents_enhanced(
         unique_filename = f"{file_id}{file_extension}"
         file_path = os.path.join(UPLOAD_DIR, unique_filename)
         
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        file_size = os.path.getsize(file_path)
+        # Copy in chunks through aiofiles so concurrent uploads are not
+        # serialized behind one blocking copy on the event loop
+        file_size = 0
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                await buffer.write(chunk)
         total_size += file_size
         
         document = Document(
@@ -403,7 +468,7 @@ async def upload_documents_enhanced(
     
     upload_session.total_size = total_size
     upload_session.status = "completed"
-    db.commit()
+    await db.commit()
     
     logger.info(f"Comprehensive upload completed: {len(uploaded_documents)} files, session: {session_id}")
     
@@ -422,29 +487,31 @@ async def upload_documents_enhanced(
 @app.post("/api/process/comprehensive/{session_id}")
 async def process_documents_comprehensive(
     session_id: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """COMPREHENSIVE document processing with no artificial limits"""
     start_time = datetime.utcnow()
     logger.info(f"Starting COMPREHENSIVE processing for session: {session_id}")
     
-    session = db.query(EnhancedUploadSession).filter(
+    session = await db.scalar(select(EnhancedUploadSession).where(
         EnhancedUploadSession.session_id == session_id,
         EnhancedUploadSession.user_id == current_user.user_id
-    ).first()
+    ))
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Get documents
-    pdf_doc = db.query(Document).filter(
-        Document.file_id == session.pdf_document_id
-    ).first()
-    
-    excel_docs = db.query(Document).filter(
-        Document.file_id.in_(session.excel_document_ids or [])
-    ).all()
+    # Get the PDF and Excel documents in one query
+    excel_ids = session.excel_document_ids or []
+    docs_by_file_id = {
+        doc.file_id: doc
+        for doc in await db.scalars(select(Document).where(
+            Document.file_id.in_([session.pdf_document_id, *excel_ids])
+        ))
+    }
+    pdf_doc = docs_by_file_id.get(session.pdf_document_id)
+    excel_docs = [docs_by_file_id[file_id] for file_id in excel_ids if file_id in docs_by_file_id]
     
     if not pdf_doc:
         raise HTTPException(status_code=400, detail="PDF document not found")
@@ -456,9 +523,26 @@ async def process_documents_comprehensive(
         # Process PDF with comprehensive extraction
         logger.info(f"COMPREHENSIVE PDF processing: {pdf_doc.filename}")
         pdf_doc.processing_status = "processing"
-        db.commit()
-        
-        pdf_analysis = await enhanced_gemini_service.extract_comprehensive_pdf_data(pdf_doc.file_path)
+        for excel_doc in excel_docs:
+            excel_doc.processing_status = "processing"
+        # One commit for every status change, which also hands the connection
+        # back to the pool while the Gemini calls run; the rows stay loaded
+        # (expire_on_commit=False) and the results are written to them below
+        await db.commit()
+        
+        # Excel parsing runs in the parse process pool, so the workbooks are
+        # analysed while the PDF extraction is in flight; a failed workbook
+        # is recorded below rather than failing the whole session
+        excel_task = asyncio.ensure_future(asyncio.gather(
+            *(enhanced_gemini_service.analyze_excel_comprehensive(excel_doc.file_path) for excel_doc in excel_docs),
+            return_exceptions=True
+        ))
+        try:
+            pdf_analysis = await enhanced_gemini_service.extract_comprehensive_pdf_data(pdf_doc.file_path)
+        except BaseException:
+            excel_task.cancel()
+            raise
+        excel_outcomes = await excel_task
         
         pdf_doc.comprehensive_analysis = pdf_analysis
         pdf_doc.processing_status = "processed"
@@ -475,14 +559,12 @@ async def process_documents_comprehensive(
             "extraction_start_time": start_time.isoformat()
         }
         
-        for excel_doc in excel_docs:
+        for excel_doc, excel_analysis in zip(excel_docs, excel_outcomes):
             logger.info(f"COMPREHENSIVE Excel processing: {excel_doc.filename}")
-            excel_doc.processing_status = "processing"
-            db.commit()
             
             try:
-                # Use the NEW comprehensive Excel extraction
-                excel_analysis = await enhanced_gemini_service.analyze_excel_comprehensive(excel_doc.file_path)
+                if isinstance(excel_analysis, Exception):
+                    raise excel_analysis
                 
                 excel_doc.comprehensive_analysis = excel_analysis
                 excel_doc.processing_status = "processed"
@@ -547,7 +629,7 @@ async def process_documents_comprehensive(
         session.validated_pdf_values = pdf_analysis.get('all_extracted_values', [])
         session.validated_excel_values = all_excel_values  # ALL EXCEL VALUES
         
-        db.commit()
+        await db.commit()
         
         pdf_count = len(pdf_analysis.get('all_extracted_values', []))
         excel_count = len(all_excel_values)
@@ -602,7 +684,7 @@ async def process_documents_comprehensive(
         for excel_doc in excel_docs:
             if excel_doc.processing_status == "processing":
                 excel_doc.processing_status = "failed"
-        db.commit()
+        await db.commit()
         
         raise HTTPException(status_code=500, detail=f"Comprehensive processing failed: {str(e)}")
 
@@ -610,16 +692,16 @@ async def process_documents_comprehensive(
 @app.get("/api/validation/data/{session_id}")
 async def get_validation_data(
     session_id: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get comprehensive validation data for direct value validation"""
     logger.info(f"Loading COMPREHENSIVE validation data for session: {session_id}")
     
-    session = db.query(EnhancedUploadSession).filter(
+    session = await db.scalar(select(EnhancedUploadSession).where(
         EnhancedUploadSession.session_id == session_id,
         EnhancedUploadSession.user_id == current_user.user_id
-    ).first()
+    ))
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -627,112 +709,77 @@ async def get_validation_data(
     if not session.extraction_results:
         raise HTTPException(status_code=404, detail="No extraction results available. Please process documents first.")
     
-    try:
-        # Get PDF document for preview generation
-        pdf_doc = db.query(Document).filter(
-            Document.file_id == session.pdf_document_id
-        ).first()
-        
-        if not pdf_doc:
-            raise HTTPException(status_code=404, detail="PDF document not found")
-        
-        # Generate document preview with page images
-        document_preview = await generate_document_preview(pdf_doc.file_path)
-        
-        # Get extraction results
-        extraction_results = session.extraction_results
-        
-        # Get ALL PDF and Excel values for validation (COMPREHENSIVE)
-        pdf_values = session.validated_pdf_values or extraction_results.get("all_pdf_values", [])
-        excel_values = session.validated_excel_values or extraction_results.get("all_excel_values", [])
-        
-        # Get comprehensive statistics
-        comp_stats = session.comprehensive_statistics or {}
-        
-        # Prepare COMPREHENSIVE validation data
-        validation_data = {
-            "session_id": session_id,
-            "approach": "comprehensive_direct_value_validation",
-            "document_preview": document_preview,
-            "pdf_values": pdf_values,
-            "excel_values": excel_values,
-            "validation_statistics": {
-                "total_pdf_values": len(pdf_values),
-                "total_excel_values": len(excel_values),
-                "total_pages": document_preview.get("total_pages", 0),
-                "total_values_for_validation": len(pdf_values) + len(excel_values),
-                "coverage": "100% - ALL extracted values available for validation",
-                "comprehensive_extraction": True,
-                "no_artificial_limits": True
-            },
-            "comprehensive_statistics": comp_stats,
-            "extraction_performance": session.extraction_performance,
-            "validation_features": {
-                "edit_pdf_values": True,
-                "edit_excel_values": True,
-                "coordinate_based_highlighting": True,
-                "comprehensive_audit": True,
-                "large_dataset_support": True,
-                "advanced_filtering": True,
-                "intelligent_pagination": True,
-                "ai_model": "gemini-2.5-pro-comprehensive"
-            },
-            "improvements": {
-                "excel_extraction_improvement": f"{len(excel_values) / max(18, 1):.1f}x more values than limited approach",
-                "processing_performance": session.extraction_performance,
-                "comprehensive_coverage": "All sheets, all rows, all columns processed within memory limits"
-            }
+    # Get PDF document for preview generation; only its path is needed
+    pdf_path = await db.scalar(select(Document.file_path).where(
+        Document.file_id == session.pdf_document_id
+    ))
+    
+    if not pdf_path:
+        raise HTTPException(status_code=404, detail="PDF document not found")
+    
+    # Generate document preview with page images
+    document_preview = await generate_document_preview(pdf_path)
+    
+    # Get extraction results
+    extraction_results = session.extraction_results
+    
+    # Get ALL PDF and Excel values for validation (COMPREHENSIVE)
+    pdf_values = session.validated_pdf_values or extraction_results.get("all_pdf_values", [])
+    excel_values = session.validated_excel_values or extraction_results.get("all_excel_values", [])
+    
+    # Get comprehensive statistics
+    comp_stats = session.comprehensive_statistics or {}
+    
+    # Prepare COMPREHENSIVE validation data
+    validation_data = {
+        "session_id": session_id,
+        "approach": "comprehensive_direct_value_validation",
+        "document_preview": document_preview,
+        "pdf_values": pdf_values,
+        "excel_values": excel_values,
+        "validation_statistics": {
+            "total_pdf_values": len(pdf_values),
+            "total_excel_values": len(excel_values),
+            "total_pages": document_preview.get("total_pages", 0),
+            "total_values_for_validation": len(pdf_values) + len(excel_values),
+            "coverage": "100% - ALL extracted values available for validation",
+            "comprehensive_extraction": True,
+            "no_artificial_limits": True
+        },
+        "comprehensive_statistics": comp_stats,
+        "extraction_performance": session.extraction_performance,
+        "validation_features": {
+            "edit_pdf_values": True,
+            "edit_excel_values": True,
+            "coordinate_based_highlighting": True,
+            "comprehensive_audit": True,
+            "large_dataset_support": True,
+            "advanced_filtering": True,
+            "intelligent_pagination": True,
+            "ai_model": "gemini-2.5-pro-comprehensive"
+        },
+        "improvements": {
+            "excel_extraction_improvement": f"{len(excel_values) / max(18, 1):.1f}x more values than limited approach",
+            "processing_performance": session.extraction_performance,
+            "comprehensive_coverage": "All sheets, all rows, all columns processed within memory limits"
         }
-        
-        # Store validation data in session
-        session.validation_data = validation_data
-        db.commit()
-        
-        logger.info(f"COMPREHENSIVE validation data prepared: {len(pdf_values)} PDF values, {len(excel_values)} Excel values")
-        logger.info(f"Performance: {session.extraction_performance}")
-        
-        return validation_data
-        
-    except Exception as e:
-        logger.error(f"Failed to prepare comprehensive validation data for session {session_id}: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to prepare comprehensive validation data: {str(e)}")
+    }
+    
+    # Store validation data in session
+    session.validation_data = validation_data
+    await db.commit()
+    
+    logger.info(f"COMPREHENSIVE validation data prepared: {len(pdf_values)} PDF values, {len(excel_values)} Excel values")
+    logger.info(f"Performance: {session.extraction_performance}")
+    
+    return validation_data
 
 # Document preview generation (unchanged)
 async def generate_document_preview(pdf_path: str) -> Dict[str, Any]:
     """Generate document preview with page images for validation UI"""
     try:
-        import fitz  # PyMuPDF
-        
-        doc = fitz.open(pdf_path)
-        pages = []
-        
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            
-            # Generate high-quality image for preview
-            mat = fitz.Matrix(2.0, 2.0)  # 2x zoom for good quality
-            pix = page.get_pixmap(matrix=mat)
-            img_data = pix.tobytes("png")
-            
-            # Convert to base64 for frontend
-            img_base64 = base64.b64encode(img_data).decode('utf-8')
-            
-            pages.append({
-                "page_number": page_num + 1,
-                "image_data": img_base64,
-                "width": pix.width,
-                "height": pix.height,
-                "format": "png"
-            })
-        
-        doc.close()
-        
-        return {
-            "total_pages": len(pages),
-            "pages": pages,
-            "preview_quality": "high",
-            "coordinate_system": "normalized"
-        }
+        # Rendering every page blocks for a while; keep it off the event loop
+        return await run_mupdf(_render_document_preview, pdf_path)
         
     except Exception as e:
         logger.error(f"Document preview generation failed: {e}")
@@ -742,155 +789,179 @@ async def generate_document_preview(pdf_path: str) -> Dict[str, Any]:
             "error": str(e)
         }
 
+def _render_document_preview(pdf_path: str) -> Dict[str, Any]:
+    import fitz  # PyMuPDF
+    
+    doc = fitz.open(pdf_path)
+    pages = []
+    
+    for page_num in range(len(doc)):
+        page = doc[page_num]
+        
+        # Generate high-quality image for preview
+        mat = fitz.Matrix(2.0, 2.0)  # 2x zoom for good quality
+        pix = page.get_pixmap(matrix=mat)
+        img_data = pix.tobytes("png")
+        
+        # Convert to base64 for frontend
+        img_base64 = base64.b64encode(img_data).decode('utf-8')
+        
+        pages.append({
+            "page_number": page_num + 1,
+            "image_data": img_base64,
+            "width": pix.width,
+            "height": pix.height,
+            "format": "png"
+        })
+    
+    doc.close()
+    
+    return {
+        "total_pages": len(pages),
+        "pages": pages,
+        "preview_quality": "high",
+        "coordinate_system": "normalized"
+    }
+
 # Value update endpoints (unchanged)
 @app.post("/api/validation/update-pdf-value/{session_id}")
 async def update_pdf_value(
     session_id: str,
     value_data: Dict[str, Any],
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Update a PDF extracted value"""
     logger.info(f"Updating PDF value for session: {session_id}")
     
-    session = db.query(EnhancedUploadSession).filter(
+    session = await db.scalar(select(EnhancedUploadSession).where(
         EnhancedUploadSession.session_id == session_id,
         EnhancedUploadSession.user_id == current_user.user_id
-    ).first()
+    ))
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    try:
-        value_id = value_data.get("value_id")
-        updates = value_data.get("updates", {})
-        
-        if not value_id:
-            raise HTTPException(status_code=400, detail="Value ID is required")
-        
-        # Update PDF value
-        pdf_values = session.validated_pdf_values or []
-        
-        for i, value in enumerate(pdf_values):
-            if value.get("id") == value_id:
-                # Apply updates
-                for key, new_value in updates.items():
-                    if key in ["value", "business_context", "data_type"]:
-                        if key == "business_context":
-                            if "business_context" not in value:
-                                value["business_context"] = {}
-                            if isinstance(new_value, str):
-                                value["business_context"]["semantic_meaning"] = new_value
-                            else:
-                                value["business_context"].update(new_value)
+    value_id = value_data.get("value_id")
+    updates = value_data.get("updates", {})
+    
+    if not value_id:
+        raise HTTPException(status_code=400, detail="Value ID is required")
+    
+    # Update PDF value
+    pdf_values = session.validated_pdf_values or []
+    
+    for i, value in enumerate(pdf_values):
+        if value.get("id") == value_id:
+            # Apply updates
+            for key, new_value in updates.items():
+                if key in ["value", "business_context", "data_type"]:
+                    if key == "business_context":
+                        if "business_context" not in value:
+                            value["business_context"] = {}
+                        if isinstance(new_value, str):
+                            value["business_context"]["semantic_meaning"] = new_value
                         else:
-                            value[key] = new_value
-                
-                # Mark as user modified
-                value["user_modified"] = True
-                value["modified_by"] = current_user.username
-                value["modification_timestamp"] = datetime.utcnow().isoformat()
-                
-                pdf_values[i] = value
-                break
-        else:
-            raise HTTPException(status_code=404, detail="PDF value not found")
-        
-        # Update session
-        session.validated_pdf_values = pdf_values
-        db.commit()
-        
-        logger.info(f"PDF value {value_id} updated successfully")
-        
-        return {
-            "status": "success",
-            "value_id": value_id,
-            "updated_fields": list(updates.keys()),
-            "message": "PDF value updated successfully"
-        }
-        
-    except Exception as e:
-        logger.error(f"Failed to update PDF value: {e}")
-        raise HTTPException(status_code=500, detail=f"PDF value update failed: {str(e)}")
+                            value["business_context"].update(new_value)
+                    else:
+                        value[key] = new_value
+            
+            # Mark as user modified
+            value["user_modified"] = True
+            value["modified_by"] = current_user.username
+            value["modification_timestamp"] = datetime.utcnow().isoformat()
+            
+            pdf_values[i] = value
+            break
+    else:
+        raise HTTPException(status_code=404, detail="PDF value not found")
+    
+    # Update session
+    session.validated_pdf_values = pdf_values
+    await db.commit()
+    
+    logger.info(f"PDF value {value_id} updated successfully")
+    
+    return {
+        "status": "success",
+        "value_id": value_id,
+        "updated_fields": list(updates.keys()),
+        "message": "PDF value updated successfully"
+    }
 
 @app.post("/api/validation/update-excel-value/{session_id}")
 async def update_excel_value(
     session_id: str,
     value_data: Dict[str, Any],
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Update an Excel extracted value"""
     logger.info(f"Updating Excel value for session: {session_id}")
     
-    session = db.query(EnhancedUploadSession).filter(
+    session = await db.scalar(select(EnhancedUploadSession).where(
         EnhancedUploadSession.session_id == session_id,
         EnhancedUploadSession.user_id == current_user.user_id
-    ).first()
+    ))
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    try:
-        value_id = value_data.get("value_id")
-        updates = value_data.get("updates", {})
-        
-        if not value_id:
-            raise HTTPException(status_code=400, detail="Value ID is required")
-        
-        # Update Excel value
-        excel_values = session.validated_excel_values or []
-        
-        for i, value in enumerate(excel_values):
-            # Use cell_reference + source_file as unique identifier for Excel values
-            value_identifier = f"{value.get('source_file', '')}_{value.get('cell_reference', '')}"
-            if value_identifier == value_id or value.get("id") == value_id:
-                # Apply updates
-                for key, new_value in updates.items():
-                    if key in ["value", "business_context", "data_type"]:
-                        value[key] = new_value
-                
-                # Mark as user modified
-                value["user_modified"] = True
-                value["modified_by"] = current_user.username
-                value["modification_timestamp"] = datetime.utcnow().isoformat()
-                
-                excel_values[i] = value
-                break
-        else:
-            raise HTTPException(status_code=404, detail="Excel value not found")
-        
-        # Update session
-        session.validated_excel_values = excel_values
-        db.commit()
-        
-        logger.info(f"Excel value {value_id} updated successfully")
-        
-        return {
-            "status": "success",
-            "value_id": value_id,
-            "updated_fields": list(updates.keys()),
-            "message": "Excel value updated successfully"
-        }
-        
-    except Exception as e:
-        logger.error(f"Failed to update Excel value: {e}")
-        raise HTTPException(status_code=500, detail=f"Excel value update failed: {str(e)}")
+    value_id = value_data.get("value_id")
+    updates = value_data.get("updates", {})
+    
+    if not value_id:
+        raise HTTPException(status_code=400, detail="Value ID is required")
+    
+    # Update Excel value
+    excel_values = session.validated_excel_values or []
+    
+    for i, value in enumerate(excel_values):
+        # Use cell_reference + source_file as unique identifier for Excel values
+        value_identifier = f"{value.get('source_file', '')}_{value.get('cell_reference', '')}"
+        if value_identifier == value_id or value.get("id") == value_id:
+            # Apply updates
+            for key, new_value in updates.items():
+                if key in ["value", "business_context", "data_type"]:
+                    value[key] = new_value
+            
+            # Mark as user modified
+            value["user_modified"] = True
+            value["modified_by"] = current_user.username
+            value["modification_timestamp"] = datetime.utcnow().isoformat()
+            
+            excel_values[i] = value
+            break
+    else:
+        raise HTTPException(status_code=404, detail="Excel value not found")
+    
+    # Update session
+    session.validated_excel_values = excel_values
+    await db.commit()
+    
+    logger.info(f"Excel value {value_id} updated successfully")
+    
+    return {
+        "status": "success",
+        "value_id": value_id,
+        "updated_fields": list(updates.keys()),
+        "message": "Excel value updated successfully"
+    }
 
 # Comprehensive Direct Audit
 @app.post("/api/validation/start-direct-audit/{session_id}")
 async def start_direct_audit(
     session_id: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Start direct comprehensive audit of ALL PDF vs ALL Excel values"""
     logger.info(f"Starting COMPREHENSIVE direct audit for session: {session_id}")
     
-    session = db.query(EnhancedUploadSession).filter(
+    session = await db.scalar(select(EnhancedUploadSession).where(
         EnhancedUploadSession.session_id == session_id,
         EnhancedUploadSession.user_id == current_user.user_id
-    ).first()
+    ))
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -934,14 +1005,14 @@ async def start_direct_audit(
         audit_session.comprehensive_audit_metadata = audit_metadata
         
         db.add(audit_session)
-        db.commit()
+        await db.commit()
         
         logger.info(f"COMPREHENSIVE direct audit session created: {audit_session_id}")
         logger.info(f"Auditing {len(pdf_values)} PDF values against {len(excel_values)} Excel values")
         
         # Run direct comprehensive audit
         audit_session.status = "running"
-        db.commit()
+        await db.commit()
         
         start_time = datetime.utcnow()
         
@@ -975,12 +1046,12 @@ async def start_direct_audit(
         # Save results
         audit_session.audit_results = enhanced_audit_results
         audit_session.status = "completed"
-        audit_session.completion_date = datetime.utcnow()
+        audit_session.completion_date = end_time
         audit_session.comprehensive_audit_metadata.update({
             "completion_timestamp": end_time.isoformat(),
             "audit_duration_seconds": audit_duration
         })
-        db.commit()
+        await db.commit()
         
         summary = audit_results.get("summary", {})
         matched = summary.get("matched", 0)
@@ -1010,7 +1081,7 @@ async def start_direct_audit(
         try:
             if 'audit_session' in locals():
                 audit_session.status = "failed"
-                db.commit()
+                await db.commit()
         except:
             pass
         
@@ -1021,29 +1092,39 @@ async def start_direct_audit(
 @app.get("/api/validation/status/{session_id}")
 async def get_validation_status(
     session_id: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get validation status for comprehensive approach"""
-    session = db.query(EnhancedUploadSession).filter(
+    # Only presence flags and value counts are reported, so they are computed
+    # in the query; the extraction results, validation data (page images) and
+    # value lists are never loaded. These columns are SQL NULL until processing
+    # or validation stores a non-empty value in them
+    session = (await db.execute(select(
+        EnhancedUploadSession.extraction_results.is_not(None).label("has_extraction"),
+        EnhancedUploadSession.validation_data.is_not(None).label("has_validation_data"),
+        func.coalesce(func.json_array_length(EnhancedUploadSession.validated_pdf_values), 0).label("pdf_count"),
+        func.coalesce(func.json_array_length(EnhancedUploadSession.validated_excel_values), 0).label("excel_count"),
+        EnhancedUploadSession.comprehensive_statistics,
+        EnhancedUploadSession.extraction_performance
+    ).where(
         EnhancedUploadSession.session_id == session_id,
         EnhancedUploadSession.user_id == current_user.user_id
-    ).first()
+    ))).one_or_none()
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     # Check validation readiness
-    has_extraction = bool(session.extraction_results)
-    has_validation_data = bool(session.validation_data)
-    
-    pdf_values = session.validated_pdf_values or []
-    excel_values = session.validated_excel_values or []
+    has_extraction = bool(session.has_extraction)
+    has_validation_data = bool(session.has_validation_data)
+    pdf_count = session.pdf_count
+    excel_count = session.excel_count
     
     ready_for_audit = (
         has_extraction and 
-        len(pdf_values) > 0 and 
-        len(excel_values) > 0
+        pdf_count > 0 and 
+        excel_count > 0
     )
     
     return {
@@ -1052,9 +1133,9 @@ async def get_validation_status(
         "validation_status": {
             "has_extraction_results": has_extraction,
             "has_validation_data": has_validation_data,
-            "total_pdf_values": len(pdf_values),
-            "total_excel_values": len(excel_values),
-            "total_values_for_validation": len(pdf_values) + len(excel_values),
+            "total_pdf_values": pdf_count,
+            "total_excel_values": excel_count,
+            "total_values_for_validation": pdf_count + excel_count,
             "ready_for_audit": ready_for_audit,
             "coverage": "100% of ALL extracted values",
             "comprehensive_extraction": True
@@ -1067,7 +1148,7 @@ async def get_validation_status(
             "Start comprehensive direct audit"
         ] if ready_for_audit else [
             "Complete document processing" if not has_extraction else None,
-            "Review extracted values" if len(pdf_values) == 0 else None
+            "Review extracted values" if pdf_count == 0 else None
         ]
     }
 
@@ -1075,14 +1156,14 @@ async def get_validation_status(
 @app.get("/api/audit/results/{audit_session_id}")
 async def get_direct_audit_results(
     audit_session_id: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get comprehensive direct audit results"""
-    audit_session = db.query(DirectAuditSession).filter(
+    audit_session = await db.scalar(select(DirectAuditSession).where(
         DirectAuditSession.audit_session_id == audit_session_id,
         DirectAuditSession.user_id == current_user.user_id
-    ).first()
+    ))
     
     if not audit_session:
         raise HTTPException(status_code=404, detail="Audit session not found")
@@ -1093,8 +1174,8 @@ async def get_direct_audit_results(
         "status": audit_session.status,
         "approach": "comprehensive_direct_validation",
         "ai_model": "gemini-2.5-pro-comprehensive",
-        "created_date": audit_session.created_date.isoformat(),
-        "completion_date": audit_session.completion_date.isoformat() if audit_session.completion_date else None,
+        "created_date": audit_session.created_date,
+        "completion_date": audit_session.completion_date,
         "validated_pdf_values": audit_session.validated_pdf_values,
         "validated_excel_values": audit_session.validated_excel_values,
         "audit_results": audit_session.audit_results,
@@ -1103,16 +1184,15 @@ async def get_direct_audit_results(
 
 # Statistics and Health
 @app.get("/api/documents/stats")
-async def get_enhanced_stats(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    total_docs = db.query(Document).filter(Document.user_id == current_user.user_id).count()
-    pdf_count = db.query(Document).filter(
-        Document.user_id == current_user.user_id,
-        Document.document_type == "pdf"
-    ).count()
-    excel_count = db.query(Document).filter(
-        Document.user_id == current_user.user_id,
-        Document.document_type == "excel"
-    ).count()
+async def get_enhanced_stats(current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    counts_by_type = dict((await db.execute(
+        select(Document.document_type, func.count())
+        .where(Document.user_id == current_user.user_id)
+        .group_by(Document.document_type)
+    )).all())
+    total_docs = sum(counts_by_type.values())
+    pdf_count = counts_by_type.get("pdf", 0)
+    excel_count = counts_by_type.get("excel", 0)
     
     return {
         "user": current_user.username,
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Float, JSON, Boolean
+from sqlalchemy import Column, Index, Integer, String, DateTime, Text, Float, JSON, Boolean
 from datetime import datetime
 from enum import Enum
 
@@ -28,12 +28,17 @@ class Document(Base):
     file_path = Column(String, nullable=False)
     file_type = Column(String, nullable=False)
     file_size = Column(Integer, nullable=False)
+    content_sha256 = Column(String(64), nullable=True)
     upload_date = Column(DateTime, default=datetime.utcnow)
     user_id = Column(String, nullable=False)
     document_type = Column(String, nullable=False)
     extraction_data = Column(JSON, nullable=True)
     processing_status = Column(String, default="uploaded")
     
+    __table_args__ = (
+        Index("ix_documents_user_sha256", user_id, content_sha256),  # duplicate upload check
+    )
+    
 class AuditSession(Base):
     __tablename__ = "audit_sessions"
     
@@ -47,6 +52,10 @@ class AuditSession(Base):
     mapping_data = Column(JSON, nullable=True)
     audit_results = Column(JSON, nullable=True)
     completion_date = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_audit_sessions_user_created", user_id, created_date),  # per-user session list, newest first
+    )
 
 class ValidationResult(Base):
     __tablename__ = "validation_results"
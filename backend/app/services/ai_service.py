@@ -1,29 +1,46 @@
-import google.generativeai as genai
+import asyncio
 import openai
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+from decimal import Decimal, InvalidOperation
 import json
+import math
+import orjson
+import re
 import structlog
 from app.config import settings
-from app.utils.metrics import track_ai_usage
+from app.models.document import ValidationStatus
+from app.utils.cache import ai_response_cache
+from app.utils.prompts import compact_json
+from app.utils.gemini import configure_gemini, get_gemini_model
+from app.utils.metrics import track_ai_usage, record_in_background
 import time
 
 logger = structlog.get_logger()
 
+VALIDATION_MODEL = "gemini-2.0-flash-lite"
+
+# Currency symbols, thousands separators and whitespace never change a value
+_NUMERIC_NOISE = re.compile(r"[\s,$€£¥]")
+
+# Magnitude suffixes spelled out, so "$1.25M" and "$1,250,000" are one value
+_MAGNITUDE_SUFFIXES = {"k": Decimal(10) ** 3, "m": Decimal(10) ** 6, "mm": Decimal(10) ** 6, "b": Decimal(10) ** 9, "bn": Decimal(10) ** 9}
+_MAGNITUDE_PATTERN = re.compile(r"^(.*?\d)(k|mm|m|bn|b)$", re.IGNORECASE)
+
+# Outermost JSON object or array in a reply, whatever fences or prose surround it
+_JSON_PAYLOAD = re.compile(r"\{.*\}|\[.*\]", re.S)
+
+# Shared by every prompt below; sent once as the system instruction so only the
+# per-call text varies and the provider can reuse the cached prefix
+AUDITOR_SYSTEM_INSTRUCTION = (
+    "You are an expert financial auditor who reconciles presentation decks against their source "
+    "spreadsheets. Reply with valid JSON only, in exactly the format each request describes."
+)
+
 class AIService:
-    def __init__(self):
-        if settings.GOOGLE_API_KEY:
-            genai.configure(api_key=settings.GOOGLE_API_KEY)
-            self.gemini_model = genai.GenerativeModel('gemini-2.0-flash-exp')
-        
-        if settings.OPENAI_API_KEY:
-            openai.api_key = settings.OPENAI_API_KEY
-    
-    async def extract_pdf_content(self, pdf_text: str, pdf_images: List[bytes] = None) -> Dict[str, Any]:
-        """Extract structured content from PDF using AI"""
-        start_time = time.time()
-        
-        prompt = """
-        You are an expert financial document analyzer. Extract all numerical data, tables, charts, and key financial metrics from this presentation.
+    # Prompt templates, built once. Static instructions come first and the
+    # per-call data last, so repeated calls share the longest possible prefix.
+    _PDF_EXTRACTION_TEMPLATE = """
+        Extract all numerical data, tables, charts, and key financial metrics from this presentation.
         
         For each piece of data found, provide:
         1. The exact value as it appears
@@ -33,71 +50,40 @@ class AIService:
         5. The data type (currency, percentage, count, etc.)
         
         Return the results in this JSON format:
-        {
+        {{
             "extracted_values": [
-                {
+                {{
                     "value": "actual_value",
                     "context": "description_of_what_this_value_represents",
                     "slide_number": number,
                     "data_type": "currency|percentage|count|ratio",
                     "location": "approximate_location_on_slide",
                     "confidence": confidence_score_0_to_1
-                }
+                }}
             ],
             "tables": [
-                {
+                {{
                     "slide_number": number,
                     "table_data": "structured_table_as_text",
                     "headers": ["col1", "col2", ...],
                     "rows": [["val1", "val2", ...], ...]
-                }
+                }}
             ],
             "charts": [
-                {
+                {{
                     "slide_number": number,
                     "chart_type": "bar|line|pie|etc",
                     "data_points": ["extracted_data_points"],
                     "description": "chart_description"
-                }
+                }}
             ]
-        }
+        }}
         
         PDF Content:
-        """ + pdf_text
-        
-        try:
-            response = self.gemini_model.generate_content(prompt)
-            result = self._parse_json_response(response.text)
-            
-            latency = (time.time() - start_time) * 1000
-            await track_ai_usage(
-                operation_type="pdf_extraction",
-                model="gemini-2.0-flash-exp",
-                tokens_used=len(prompt.split()) + len(response.text.split()),
-                latency_ms=latency,
-                success=True
-            )
-            
-            return result
-            
-        except Exception as e:
-            latency = (time.time() - start_time) * 1000
-            await track_ai_usage(
-                operation_type="pdf_extraction",
-                model="gemini-2.0-flash-exp",
-                latency_ms=latency,
-                success=False,
-                error_message=str(e)
-            )
-            logger.error("PDF extraction failed", error=str(e))
-            raise
+        {pdf_text}"""
     
-    async def extract_excel_content(self, excel_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Extract and understand Excel data using AI"""
-        start_time = time.time()
-        
-        prompt = f"""
-        You are an expert at analyzing Excel spreadsheets for financial data. Analyze this Excel file structure and identify all numerical data, formulas, and relationships.
+    _EXCEL_EXTRACTION_TEMPLATE = """
+        Analyze this Excel file structure and identify all numerical data, formulas, and relationships.
         
         For each sheet, identify:
         1. Key financial metrics and their values
@@ -105,9 +91,6 @@ class AIService:
         3. Calculated fields and formulas
         4. Relationships between different data points
         
-        Excel Structure:
-        {json.dumps(excel_data, indent=2)}
-        
         Return results in this JSON format:
         {{
             "sheets": [
@@ -142,41 +125,12 @@ class AIService:
                 }}
             ]
         }}
-        """
         
-        try:
-            response = self.gemini_model.generate_content(prompt)
-            result = self._parse_json_response(response.text)
-            
-            latency = (time.time() - start_time) * 1000
-            await track_ai_usage(
-                operation_type="excel_extraction",
-                model="gemini-2.0-flash-exp",
-                tokens_used=len(prompt.split()) + len(response.text.split()),
-                latency_ms=latency,
-                success=True
-            )
-            
-            return result
-            
-        except Exception as e:
-            latency = (time.time() - start_time) * 1000
-            await track_ai_usage(
-                operation_type="excel_extraction",
-                model="gemini-2.0-flash-exp",
-                latency_ms=latency,
-                success=False,
-                error_message=str(e)
-            )
-            logger.error("Excel extraction failed", error=str(e))
-            raise
+        Excel Structure:
+        {excel_data}"""
     
-    async def suggest_mappings(self, pdf_data: Dict[str, Any], excel_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Use AI to suggest mappings between PDF values and Excel sources"""
-        start_time = time.time()
-        
-        prompt = f"""
-        You are an expert at mapping financial presentation data to source spreadsheets. Analyze the extracted PDF data and Excel data to suggest likely mappings.
+    _MAPPING_TEMPLATE = """
+        Analyze the extracted PDF data and Excel data to suggest likely mappings between presentation values and their spreadsheet sources.
         
         For each value in the PDF, suggest the most likely Excel source based on:
         1. Exact value matches
@@ -184,12 +138,6 @@ class AIService:
         3. Data type compatibility
         4. Common financial reporting patterns
         
-        PDF Data:
-        {json.dumps(pdf_data, indent=2)}
-        
-        Excel Data:
-        {json.dumps(excel_data, indent=2)}
-        
         Return mappings in this JSON format:
         {{
             "suggested_mappings": [
@@ -221,104 +169,301 @@ class AIService:
                 }}
             ]
         }}
+        
+        PDF Data:
+        {pdf_data}
+        
+        Excel Data:
+        {excel_data}"""
+    
+    _VALIDATION_TEMPLATE = """
+        Compare these values and determine if they match, considering:
+        
+        1. Exact numerical match
+        2. Formatting differences (e.g., "$1,000" vs "1000")
+        3. Rounding differences
+        4. Unit conversions (millions, thousands, etc.)
+        5. Contextual appropriateness
+        
+        Return validation in this JSON format:
+        {{
+            "status": "matched|mismatched|formatting_error|unverifiable",
+            "confidence": confidence_score_0_to_1,
+            "reasoning": "detailed_explanation_of_validation_decision",
+            "normalized_pdf_value": "standardized_pdf_value",
+            "normalized_excel_value": "standardized_excel_value",
+            "discrepancy_type": "exact_match|formatting_difference|rounding_difference|unit_conversion|value_mismatch|context_mismatch|null",
+            "suggested_action": "recommendation_for_user"
+        }}
+        
+        PDF Value: "{pdf_value}"
+        PDF Context: "{pdf_context}"
+        
+        Excel Value: "{excel_value}"
+        Excel Context: "{excel_context}"
         """
+    
+    def __init__(self):
+        if settings.GOOGLE_API_KEY:
+            configure_gemini(settings.GOOGLE_API_KEY)
+            self.gemini_model = get_gemini_model('gemini-2.0-flash-exp', AUDITOR_SYSTEM_INSTRUCTION)
+            # Cheaper tier for single-value comparisons
+            self.gemini_lite_model = get_gemini_model(VALIDATION_MODEL, AUDITOR_SYSTEM_INSTRUCTION)
+        
+        if settings.OPENAI_API_KEY:
+            openai.api_key = settings.OPENAI_API_KEY
+    
+    async def extract_pdf_content(self, pdf_text: str, pdf_images: List[bytes] = None) -> Dict[str, Any]:
+        """Extract structured content from PDF using AI"""
+        start_time = time.perf_counter()
+        
+        prompt = self._PDF_EXTRACTION_TEMPLATE.format(pdf_text=pdf_text)
+        
+        try:
+            result, response_text = await self._generate_json(prompt)
+            
+            latency = (time.perf_counter() - start_time) * 1000
+            record_in_background(track_ai_usage(
+                operation_type="pdf_extraction",
+                model="gemini-2.0-flash-exp",
+                tokens_used=len(prompt.split()) + len(response_text.split()),
+                latency_ms=latency,
+                success=True
+            ))
+            
+            return result
+            
+        except Exception as e:
+            latency = (time.perf_counter() - start_time) * 1000
+            record_in_background(track_ai_usage(
+                operation_type="pdf_extraction",
+                model="gemini-2.0-flash-exp",
+                latency_ms=latency,
+                success=False,
+                error_message=str(e)
+            ))
+            logger.error("PDF extraction failed", error=str(e))
+            raise
+    
+    async def extract_excel_content(self, excel_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Extract and understand Excel data using AI"""
+        start_time = time.perf_counter()
+        
+        prompt = self._EXCEL_EXTRACTION_TEMPLATE.format(excel_data=compact_json(excel_data))
+        
+        try:
+            result, response_text = await self._generate_json(prompt)
+            
+            latency = (time.perf_counter() - start_time) * 1000
+            record_in_background(track_ai_usage(
+                operation_type="excel_extraction",
+                model="gemini-2.0-flash-exp",
+                tokens_used=len(prompt.split()) + len(response_text.split()),
+                latency_ms=latency,
+                success=True
+            ))
+            
+            return result
+            
+        except Exception as e:
+            latency = (time.perf_counter() - start_time) * 1000
+            record_in_background(track_ai_usage(
+                operation_type="excel_extraction",
+                model="gemini-2.0-flash-exp",
+                latency_ms=latency,
+                success=False,
+                error_message=str(e)
+            ))
+            logger.error("Excel extraction failed", error=str(e))
+            raise
+    
+    async def suggest_mappings(self, pdf_data: Dict[str, Any], excel_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Use AI to suggest mappings between PDF values and Excel sources"""
+        start_time = time.perf_counter()
+        
+        # Serializing every extracted workbook is CPU work proportional to the
+        # upload, so the prompt is built in a worker thread
+        prompt = await asyncio.to_thread(self._build_mapping_prompt, pdf_data, excel_data)
         
         try:
-            response = self.gemini_model.generate_content(prompt)
-            result = self._parse_json_response(response.text)
+            result, response_text = await self._generate_json(prompt)
             
-            latency = (time.time() - start_time) * 1000
-            await track_ai_usage(
+            latency = (time.perf_counter() - start_time) * 1000
+            record_in_background(track_ai_usage(
                 operation_type="mapping_suggestion",
                 model="gemini-2.0-flash-exp",
-                tokens_used=len(prompt.split()) + len(response.text.split()),
+                tokens_used=len(prompt.split()) + len(response_text.split()),
                 latency_ms=latency,
                 success=True
-            )
+            ))
             
             return result
             
         except Exception as e:
-            latency = (time.time() - start_time) * 1000
-            await track_ai_usage(
+            latency = (time.perf_counter() - start_time) * 1000
+            record_in_background(track_ai_usage(
                 operation_type="mapping_suggestion",
                 model="gemini-2.0-flash-exp",
                 latency_ms=latency,
                 success=False,
                 error_message=str(e)
-            )
+            ))
             logger.error("Mapping suggestion failed", error=str(e))
             raise
     
     async def validate_value(self, pdf_value: str, pdf_context: str, excel_value: str, excel_context: str) -> Dict[str, Any]:
         """Use AI to validate a single value mapping"""
-        start_time = time.time()
-        
-        prompt = f"""
-        You are a financial auditor validating data consistency. Compare these values and determine if they match, considering:
-        
-        1. Exact numerical match
-        2. Formatting differences (e.g., "$1,000" vs "1000")
-        3. Rounding differences
-        4. Unit conversions (millions, thousands, etc.)
-        5. Contextual appropriateness
-        
-        PDF Value: "{pdf_value}"
-        PDF Context: "{pdf_context}"
+        # Values that are plainly equal do not need a model call
+        result = self._deterministic_validate(pdf_value, excel_value)
+        if result is not None:
+            return result
         
-        Excel Value: "{excel_value}"
-        Excel Context: "{excel_context}"
+        start_time = time.perf_counter()
         
-        Return validation in this JSON format:
-        {{
-            "status": "matched|mismatched|formatting_error|unverifiable",
-            "confidence": confidence_score_0_to_1,
-            "reasoning": "detailed_explanation_of_validation_decision",
-            "normalized_pdf_value": "standardized_pdf_value",
-            "normalized_excel_value": "standardized_excel_value",
-            "discrepancy_type": "exact_match|formatting_difference|rounding_difference|unit_conversion|value_mismatch|context_mismatch|null",
-            "suggested_action": "recommendation_for_user"
-        }}
-        """
+        prompt = self._VALIDATION_TEMPLATE.format(
+            pdf_value=pdf_value,
+            pdf_context=pdf_context,
+            excel_value=excel_value,
+            excel_context=excel_context
+        )
         
         try:
-            response = self.gemini_model.generate_content(prompt)
-            result = self._parse_json_response(response.text)
+            result, response_text = await self._generate_json(prompt, self.gemini_lite_model)
             
-            latency = (time.time() - start_time) * 1000
-            await track_ai_usage(
+            latency = (time.perf_counter() - start_time) * 1000
+            record_in_background(track_ai_usage(
                 operation_type="value_validation",
-                model="gemini-2.0-flash-exp",
-                tokens_used=len(prompt.split()) + len(response.text.split()),
+                model=VALIDATION_MODEL,
+                tokens_used=len(prompt.split()) + len(response_text.split()),
                 latency_ms=latency,
                 success=True
-            )
+            ))
             
             return result
             
         except Exception as e:
-            latency = (time.time() - start_time) * 1000
-            await track_ai_usage(
+            latency = (time.perf_counter() - start_time) * 1000
+            record_in_background(track_ai_usage(
                 operation_type="value_validation",
-                model="gemini-2.0-flash-exp",
+                model=VALIDATION_MODEL,
                 latency_ms=latency,
                 success=False,
                 error_message=str(e)
-            )
+            ))
             logger.error("Value validation failed", error=str(e))
             raise
     
+    @staticmethod
+    def _deterministic_validate(pdf_value: str, excel_value: str) -> Optional[Dict[str, Any]]:
+        """Validate without AI when both values are the same number, or None if unsure"""
+        pdf_clean = _NUMERIC_NOISE.sub("", str(pdf_value))
+        excel_clean = _NUMERIC_NOISE.sub("", str(excel_value))
+        if pdf_clean.endswith("%") != excel_clean.endswith("%"):
+            return None  # 5% vs 5 (or 0.05) is for the model to judge
+        try:
+            pdf_number = float(pdf_clean.rstrip("%"))
+            excel_number = float(excel_clean.rstrip("%"))
+        except ValueError:
+            return None
+        if not math.isclose(pdf_number, excel_number, rel_tol=1e-9, abs_tol=1e-9):
+            return None
+        
+        exact = str(pdf_value).strip() == str(excel_value).strip()
+        return {
+            "status": ValidationStatus.MATCHED,
+            "confidence": 1.0,
+            "reasoning": "Values are numerically identical" if exact else "Values are numerically identical apart from formatting",
+            "normalized_pdf_value": pdf_clean,
+            "normalized_excel_value": excel_clean,
+            "discrepancy_type": "exact_match" if exact else "formatting_difference",
+            "suggested_action": "No action needed"
+        }
+    
+    @staticmethod
+    def _canonicalize_value(value: Any) -> str:
+        """Canonical text of a numeric value ("$1,250,000.00" and "1.25M" both give "1250000"), else the stripped text"""
+        text = str(value).strip()
+        clean = _NUMERIC_NOISE.sub("", text)
+        negative = clean.startswith("(") and clean.endswith(")")
+        if negative:
+            clean = clean[1:-1]
+        percent = clean.endswith("%")
+        clean = clean.rstrip("%")
+        scale = Decimal(1)
+        suffixed = _MAGNITUDE_PATTERN.match(clean)
+        if suffixed and not percent:
+            clean, scale = suffixed.group(1), _MAGNITUDE_SUFFIXES[suffixed.group(2).lower()]
+        try:
+            number = Decimal(clean) * scale
+        except InvalidOperation:
+            return text
+        if not number.is_finite():
+            return text
+        if negative:
+            number = -number
+        return format(number.normalize(), "f") + ("%" if percent else "")
+    
+    def _build_mapping_prompt(self, pdf_data: Dict[str, Any], excel_data: Dict[str, Any]) -> str:
+        """Mapping prompt with the deduplicated PDF values and every workbook's extraction"""
+        return self._MAPPING_TEMPLATE.format(
+            pdf_data=compact_json(self._dedupe_pdf_values(pdf_data)),
+            excel_data=compact_json(excel_data)
+        )
+    
+    def _dedupe_pdf_values(self, pdf_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Drop extracted values that repeat an earlier one on the same slide and in the same context once formatting is ignored"""
+        values = pdf_data.get("extracted_values") if isinstance(pdf_data, dict) else None
+        if not isinstance(values, list):
+            return pdf_data
+        # First occurrence wins and keeps its place. The same figure on another
+        # slide or for another metric (12% growth vs 12% margin) is kept.
+        unique = {}
+        for item in values:
+            if isinstance(item, dict):
+                key = (
+                    self._canonicalize_value(item.get("value")),
+                    item.get("slide_number"),
+                    " ".join(str(item.get("context") or "").lower().split())
+                )
+            else:
+                key = (self._canonicalize_value(item), None, "")
+            unique.setdefault(key, item)
+        return {**pdf_data, "extracted_values": list(unique.values())}
+    
+    async def _generate_json(self, prompt, model=None) -> Tuple[Dict[str, Any], str]:
+        """(parsed JSON, raw text) of a Gemini completion; only replies that parse are cached"""
+        model = model or self.gemini_model
+        # Identical prompts (re-uploads of unchanged documents) are served from cache
+        cache_key = ai_response_cache.key_for(model.model_name, prompt)
+        cached = await ai_response_cache.get(cache_key)
+        if cached is not None:
+            return self._parse_json_response(cached), cached
+        
+        response_text = await self._generate_text(prompt, model)
+        result = self._parse_json_response(response_text)  # raises before a bad reply is cached
+        await ai_response_cache.set(cache_key, response_text)
+        return result, response_text
+    
+    async def _generate_text(self, prompt, model) -> str:
+        """Stream a Gemini completion without blocking the event loop and return the joined text"""
+        response = await model.generate_content_async(prompt, stream=True)
+        chunks = []
+        async for chunk in response:
+            if chunk.parts:  # the closing chunk may carry only finish metadata
+                chunks.append(chunk.text)
+        return "".join(chunks)
+    
     def _parse_json_response(self, response_text: str) -> Dict[str, Any]:
         """Parse JSON from AI response, handling markdown formatting"""
+        match = _JSON_PAYLOAD.search(response_text)
+        payload = match.group(0) if match else response_text
         try:
-            # Remove markdown code blocks if present
-            cleaned_text = response_text.strip()
-            if cleaned_text.startswith("```json"):
-                cleaned_text = cleaned_text[7:]
-            if cleaned_text.endswith("```"):
-                cleaned_text = cleaned_text[:-3]
-            
-            return json.loads(cleaned_text.strip())
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            pass
+        try:
+            # json also accepts NaN/Infinity, which orjson rejects
+            return json.loads(payload)
         except json.JSONDecodeError as e:
             logger.error("Failed to parse AI response as JSON", response=response_text, error=str(e))
             raise ValueError(f"Invalid JSON response from AI: {str(e)}")
@@ -1,18 +1,66 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
+import orjson
 import structlog
-from app.services.ai_service import ai_service
+from app.services.ai_service import VALIDATION_MODEL, ai_service
 from app.models.document import ValidationStatus
+from app.utils.cache import ai_response_cache
+from app.utils.prompts import compact_json
 import asyncio
 import re
 
 logger = structlog.get_logger()
 
+MAX_CONCURRENT_VALIDATIONS = 5
+
 class AuditService:
     def __init__(self):
         self.ai_service = ai_service
     
     async def run_comprehensive_audit(self, pdf_data: Dict[str, Any], excel_data: Dict[str, Any], user_mappings: Dict[str, Any]) -> Dict[str, Any]:
-        """Run a comprehensive audit comparing PDF and Excel data"""
+        """Run a comprehensive audit comparing PDF and Excel data; re-runs of an unchanged audit reuse the stored result"""
+        confirmed_mappings = user_mappings.get("confirmed_mappings", [])
+        cache_key, order = await asyncio.to_thread(self._audit_cache_key, confirmed_mappings, excel_data)
+        cached = await ai_response_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Reusing results for unchanged audit", mappings=len(confirmed_mappings))
+            audit_results = orjson.loads(cached)
+            # Stored in canonical order; hand results back in this request's order
+            detailed_results = [None] * len(order)
+            for result, position in zip(audit_results["detailed_results"], order):
+                detailed_results[position] = result
+            audit_results["detailed_results"] = detailed_results
+            return audit_results
+        
+        audit_results = await self._run_comprehensive_audit(pdf_data, excel_data, confirmed_mappings)
+        detailed_results = audit_results["detailed_results"]
+        # Do not pin results from failed validations; a re-run may succeed
+        if len(detailed_results) == len(order) and not any("error" in result for result in detailed_results):
+            await ai_response_cache.set(cache_key, compact_json({
+                **audit_results,
+                "detailed_results": [detailed_results[position] for position in order]
+            }))
+        return audit_results
+    
+    def _audit_cache_key(self, confirmed_mappings: List[Dict[str, Any]], excel_data: Dict[str, Any]) -> Tuple[str, List[int]]:
+        """(cache key, canonical order of the mappings) for an audit.
+
+        The key covers exactly what the audit reads: each mapping and the Excel
+        value it points at. Entries are sorted first, so the same mappings
+        confirmed in a different order still hit.
+        """
+        entries = [
+            orjson.dumps(
+                (mapping, self._get_excel_cell_value(excel_data, mapping.get("excel_sheet"), mapping.get("excel_cell"))),
+                default=str,
+                option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+            )
+            for mapping in confirmed_mappings
+        ]
+        order = sorted(range(len(entries)), key=entries.__getitem__)
+        cache_key = ai_response_cache.key_for(f"{VALIDATION_MODEL}:audit", *(entries[position] for position in order))
+        return cache_key, order
+    
+    async def _run_comprehensive_audit(self, pdf_data: Dict[str, Any], excel_data: Dict[str, Any], confirmed_mappings: List[Dict[str, Any]]) -> Dict[str, Any]:
         logger.info("Starting comprehensive audit")
         
         audit_results = {
@@ -29,20 +77,19 @@ class AuditService:
             "risk_assessment": "low"
         }
         
-        # Process each mapping
-        validation_tasks = []
-        for mapping in user_mappings.get("confirmed_mappings", []):
-            task = self._validate_single_mapping(mapping, pdf_data, excel_data)
-            validation_tasks.append(task)
+        # Run validations concurrently, capped to stay inside Gemini rate limits.
+        # The semaphore keeps the window full rather than waiting on the slowest
+        # call of each fixed batch.
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_VALIDATIONS)
         
-        # Run validations concurrently (but limit concurrency to avoid rate limits)
-        batch_size = 5
-        all_results = []
+        async def validate(mapping):
+            async with semaphore:
+                return await self._validate_single_mapping(mapping, pdf_data, excel_data)
         
-        for i in range(0, len(validation_tasks), batch_size):
-            batch = validation_tasks[i:i+batch_size]
-            batch_results = await asyncio.gather(*batch, return_exceptions=True)
-            all_results.extend(batch_results)
+        all_results = await asyncio.gather(
+            *(validate(mapping) for mapping in confirmed_mappings),
+            return_exceptions=True
+        )
         
         # Process results
         for result in all_results:
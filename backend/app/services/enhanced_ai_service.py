@@ -1,4 +1,3 @@
-import google.generativeai as genai
 from typing import Dict, Any, List, Tuple, Optional
 import json
 import base64
@@ -10,13 +9,32 @@ import asyncio
 import os
 import fitz  # PyMuPDF
 from decouple import config
+from app.utils.cache import ai_response_cache
+from app.utils.prompts import compact_json
+from app.utils.concurrency import run_in_process, run_mupdf
+from app.utils.gemini import configure_gemini, get_gemini_model
+from app.services.excel_service import COLUMN_LETTERS, region_cell_offsets, region_window_counts, sheet_extent
+from app.utils.file_handler import file_fingerprint
 import re
 from datetime import datetime
 import math
+import numpy as np
+import orjson
+from collections import Counter
 
 # Configure logging
 logger = structlog.get_logger()
 
+# Fields the audit prompt needs; coordinates, reasoning and scores are dropped
+AUDIT_PDF_PROMPT_FIELDS = ("id", "value", "normalized_value", "data_type", "business_context", "page_number")
+AUDIT_EXCEL_PROMPT_FIELDS = ("source_file", "sheet_name", "cell_reference", "value", "business_context", "data_type")
+
+# Rough chars-per-token ratio for JSON-heavy prompts, used for pre-flight budgeting
+CHARS_PER_TOKEN = 4
+
+# Currency symbols in a number format, matched in one regex pass per cell
+CURRENCY_FORMAT_PATTERN = re.compile(r"[$€£¥]")
+
 class EnhancedGeminiService:
     def __init__(self):
         # Get API key from environment
@@ -25,8 +43,8 @@ class EnhancedGeminiService:
         if not api_key:
             raise ValueError("GOOGLE_API_KEY is required for Gemini 2.5 Pro")
         
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        configure_gemini(api_key)
+        self.model = get_gemini_model('gemini-2.0-flash-exp')
         self.ai_enabled = True
         
         # Configuration for comprehensive extraction
@@ -34,6 +52,8 @@ class EnhancedGeminiService:
         self.max_sheets_per_workbook = 50  # Process up to 50 sheets
         self.max_rows_per_sheet = 1000  # Up from 50
         self.max_cols_per_sheet = 100   # Up from 20
+        self.max_concurrent_audit_batches = 3  # Parallel Gemini calls during direct audits
+        self.max_audit_prompt_tokens = 12000  # Estimated input budget for Excel values per audit batch
         
         logger.info("Enhanced Gemini 2.5 Pro Service initialized with comprehensive extraction settings")
 
@@ -41,26 +61,34 @@ class EnhancedGeminiService:
         """
         Comprehensive PDF extraction using Gemini 2.5 Pro with bounding boxes
         """
+        return await self._cached_file_extraction("pdf_extraction", pdf_path, self._extract_comprehensive_pdf_data)
+
+    async def _extract_comprehensive_pdf_data(self, pdf_path: str) -> Dict[str, Any]:
         logger.info(f"Starting comprehensive PDF extraction: {pdf_path}")
         
         try:
-            doc = fitz.open(pdf_path)
+            # All PyMuPDF work (open, render, close) runs on the MuPDF thread
+            doc = await run_mupdf(fitz.open, pdf_path)
             page_analyses = []
             
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                
-                # Extract high-quality page image with coordinates
-                page_data = await self._extract_page_with_coordinates(page, page_num + 1)
-                page_analyses.append(page_data)
-                
-                # Rate limiting for Gemini API
-                await asyncio.sleep(1.5)
-            
-            doc.close()
+            try:
+                for page_num in range(doc.page_count):
+                    img_data = await run_mupdf(self._render_page_png, doc, page_num)
+                    
+                    # Extract high-quality page image with coordinates
+                    page_data = await self._extract_page_with_coordinates(img_data, page_num + 1)
+                    page_analyses.append(page_data)
+                    
+                    # Rate limiting for Gemini API
+                    await asyncio.sleep(1.5)
+            finally:
+                await run_mupdf(doc.close)
             
             # Synthesize complete document analysis
             comprehensive_data = await self._synthesize_document_analysis(page_analyses)
+            failed_pages = [page_num for page_num, page in enumerate(page_analyses, 1) if "error" in page]
+            if failed_pages:
+                comprehensive_data["failed_pages"] = failed_pages
             
             logger.info(f"PDF extraction completed: {len(comprehensive_data.get('all_extracted_values', []))} values found")
             return comprehensive_data
@@ -69,16 +97,17 @@ class EnhancedGeminiService:
             logger.error(f"PDF extraction failed: {e}")
             raise
 
-    async def _extract_page_with_coordinates(self, page, page_num: int) -> Dict[str, Any]:
+    @staticmethod
+    def _render_page_png(doc, page_index: int) -> bytes:
+        """Render one page as a high-resolution PNG (blocking; call via run_mupdf)"""
+        mat = fitz.Matrix(2.0, 2.0)  # High quality for better extraction
+        return doc[page_index].get_pixmap(matrix=mat).tobytes("png")
+
+    async def _extract_page_with_coordinates(self, img_data: bytes, page_num: int) -> Dict[str, Any]:
         """
         Extract page data with precise coordinate mapping using Gemini 2.5 Pro
         """
         try:
-            # Convert page to high-resolution image
-            mat = fitz.Matrix(2.0, 2.0)  # High quality for better extraction
-            pix = page.get_pixmap(matrix=mat)
-            img_data = pix.tobytes("png")
-            
             # Convert to PIL Image for Gemini
             image = Image.open(io.BytesIO(img_data))
             
@@ -128,8 +157,7 @@ Return ONLY valid JSON in this exact format:
 IMPORTANT: Be thorough - extract ALL visible numbers, not just the prominent ones. Return only valid JSON.
 """
 
-            response = self.model.generate_content([prompt, image])
-            result = await self._parse_gemini_json_response_robust(response.text, f"page_{page_num}")
+            result = await self._generate_json([prompt, image], f"page_{page_num}")
             
             # Validate and enhance coordinates
             result = self._validate_and_enhance_coordinates(result, image.size)
@@ -150,17 +178,16 @@ IMPORTANT: Be thorough - extract ALL visible numbers, not just the prominent one
         """
         COMPLETELY REDESIGNED comprehensive Excel analysis - no artificial limits
         """
+        return await self._cached_file_extraction("excel_analysis", excel_path, self._analyze_excel_comprehensive)
+
+    async def _analyze_excel_comprehensive(self, excel_path: str) -> Dict[str, Any]:
         logger.info(f"Starting COMPREHENSIVE Excel analysis (no limits): {excel_path}")
         
         try:
-            import openpyxl
-            
-            # Load workbook with both data and formulas
-            wb_data = openpyxl.load_workbook(excel_path, data_only=True)
-            wb_formulas = openpyxl.load_workbook(excel_path, data_only=False)
-            
-            total_sheets = len(wb_data.sheetnames)
-            sheets_to_process = min(total_sheets, self.max_sheets_per_workbook)
+            # Parsing is pure CPU work, so it runs in a worker process; only the
+            # Gemini calls below stay on the event loop
+            total_sheets, sheet_structures = await run_in_process(extract_workbook_structures, excel_path)
+            sheets_to_process = len(sheet_structures)
             
             logger.info(f"Processing {sheets_to_process} sheets out of {total_sheets} total sheets")
             
@@ -168,15 +195,9 @@ IMPORTANT: Be thorough - extract ALL visible numbers, not just the prominent one
             sheet_analyses = []
             all_potential_sources = []
             
-            for i, sheet_name in enumerate(wb_data.sheetnames[:sheets_to_process]):
+            for i, (sheet_name, sheet_structure) in enumerate(sheet_structures):
                 logger.info(f"Processing Excel sheet {i+1}/{sheets_to_process}: {sheet_name}")
                 
-                sheet_data = wb_data[sheet_name]
-                sheet_formulas = wb_formulas[sheet_name]
-                
-                # Extract FULL sheet structure (no artificial limits)
-                sheet_structure = await self._extract_full_excel_sheet_structure(sheet_data, sheet_formulas)
-                
                 # Process in batches to handle large sheets
                 sheet_analysis = await self._analyze_excel_sheet_comprehensive_batched(sheet_name, sheet_structure)
                 sheet_analyses.append(sheet_analysis)
@@ -203,13 +224,29 @@ IMPORTANT: Be thorough - extract ALL visible numbers, not just the prominent one
             logger.error(f"Comprehensive Excel analysis failed: {e}")
             raise
 
-    async def _extract_full_excel_sheet_structure(self, sheet_data, sheet_formulas) -> Dict[str, Any]:
-        """Extract FULL Excel sheet structure - no artificial row/column limits"""
+    def _extract_workbook_structures(self, excel_path: str) -> Tuple[int, List[Tuple[str, Dict[str, Any]]]]:
+        """(total sheet count, [(sheet name, full sheet structure)]) for the sheets within the limit"""
         import openpyxl
         
+        # Read-only workbooks stream the sheet XML instead of building the full object model
+        wb_data = openpyxl.load_workbook(excel_path, data_only=True, read_only=True, keep_links=False)
+        wb_formulas = openpyxl.load_workbook(excel_path, data_only=False, read_only=True, keep_links=False)
+        try:
+            sheet_names = wb_data.sheetnames[:self.max_sheets_per_workbook]
+            return len(wb_data.sheetnames), [
+                # Extract FULL sheet structure (no artificial limits)
+                (sheet_name, self._extract_full_excel_sheet_structure(wb_data[sheet_name], wb_formulas[sheet_name]))
+                for sheet_name in sheet_names
+            ]
+        finally:
+            # Read-only workbooks hold the file open until closed
+            wb_data.close()
+            wb_formulas.close()
+
+    def _extract_full_excel_sheet_structure(self, sheet_data, sheet_formulas) -> Dict[str, Any]:
+        """Extract FULL Excel sheet structure - no artificial row/column limits"""
         # Get actual sheet dimensions
-        actual_max_row = sheet_data.max_row or 1
-        actual_max_col = sheet_data.max_column or 1
+        actual_max_row, actual_max_col = sheet_extent(sheet_data)
         
         # Apply reasonable limits for memory management
         max_row = min(actual_max_row, self.max_rows_per_sheet)
@@ -219,55 +256,64 @@ IMPORTANT: Be thorough - extract ALL visible numbers, not just the prominent one
         
         cells_data = {}
         numeric_cells = []
+        # Only a sample of text cells is returned, so stop keeping them once it
+        # is full and just count the rest
         text_cells = []
+        text_cells_count = 0
         formula_cells = []
-        
-        # Extract ALL relevant cells
-        for row in range(1, max_row + 1):
-            for col in range(1, max_col + 1):
+        # Grid positions holding a cell, probed by the region scan below
+        occupied = np.zeros((max_row, max_col), dtype=bool)
+        
+        # Extract ALL relevant cells. iter_rows walks the grid far more cheaply
+        # than cell() per coordinate; the formula sheet is read values-only and
+        # only consulted for cells that actually hold a formula string
+        value_rows = sheet_data.iter_rows(max_row=max_row, max_col=max_col)
+        formula_rows = sheet_formulas.iter_rows(max_row=max_row, max_col=max_col, values_only=True)
+        for row, (cells, formula_values) in enumerate(zip(value_rows, formula_rows), start=1):
+            for col, (cell_data, formula_value) in enumerate(zip(cells, formula_values), start=1):
+                value = cell_data.value
+                if value is None:
+                    continue
                 try:
-                    cell_data = sheet_data.cell(row, col)
+                    cell_ref = f"{COLUMN_LETTERS[col - 1]}{row}"
+                    font = cell_data.font
                     
-                    if cell_data.value is not None:
-                        cell_ref = f"{openpyxl.utils.get_column_letter(col)}{row}"
-                        
-                        cell_info = {
-                            "value": cell_data.value,
-                            "data_type": type(cell_data.value).__name__,
-                            "row": row,
-                            "col": col,
-                            "number_format": getattr(cell_data, 'number_format', None),
-                            "font_bold": getattr(cell_data.font, 'bold', False) if cell_data.font else False,
-                            "font_size": getattr(cell_data.font, 'size', 11) if cell_data.font else 11
-                        }
-                        
-                        # Add formula if exists
-                        try:
-                            cell_formula = sheet_formulas.cell(row, col)
-                            if cell_formula.value and str(cell_formula.value).startswith('='):
-                                cell_info["formula"] = str(cell_formula.value)
-                                formula_cells.append({
-                                    "cell_ref": cell_ref,
-                                    "formula": cell_info["formula"],
-                                    "result_value": cell_data.value,
-                                    **cell_info
-                                })
-                        except:
-                            pass
-                        
-                        cells_data[cell_ref] = cell_info
-                        
-                        # Categorize cells by type
-                        if isinstance(cell_data.value, (int, float)) and abs(cell_data.value) > 0:
-                            numeric_cells.append({
-                                "cell_ref": cell_ref,
-                                "value": cell_data.value,
-                                **cell_info
-                            })
-                        elif isinstance(cell_data.value, str) and len(cell_data.value.strip()) > 0:
+                    cell_info = {
+                        "value": value,
+                        "data_type": type(value).__name__,
+                        "row": row,
+                        "col": col,
+                        "number_format": getattr(cell_data, 'number_format', None),
+                        "font_bold": getattr(font, 'bold', False) if font else False,
+                        "font_size": getattr(font, 'size', 11) if font else 11
+                    }
+                    
+                    # Add formula if exists
+                    if isinstance(formula_value, str) and formula_value.startswith('='):
+                        cell_info["formula"] = formula_value
+                        formula_cells.append({
+                            "cell_ref": cell_ref,
+                            "formula": formula_value,
+                            "result_value": value,
+                            **cell_info
+                        })
+                    
+                    cells_data[cell_ref] = cell_info
+                    occupied[row - 1, col - 1] = True
+                    
+                    # Categorize cells by type
+                    if isinstance(value, (int, float)) and abs(value) > 0:
+                        numeric_cells.append({
+                            "cell_ref": cell_ref,
+                            "value": value,
+                            **cell_info
+                        })
+                    elif isinstance(value, str) and len(value.strip()) > 0:
+                        text_cells_count += 1
+                        if len(text_cells) < 100:
                             text_cells.append({
                                 "cell_ref": cell_ref,
-                                "value": cell_data.value,
+                                "value": value,
                                 **cell_info
                             })
                 
@@ -276,7 +322,7 @@ IMPORTANT: Be thorough - extract ALL visible numbers, not just the prominent one
                     continue
         
         # Detect data regions and important patterns
-        data_regions = self._detect_comprehensive_data_regions(cells_data, max_row, max_col)
+        data_regions = self._detect_comprehensive_data_regions(cells_data, occupied)
         
         # Identify high-value cells (likely to be KPIs)
         high_value_cells = self._identify_high_value_cells(numeric_cells, text_cells)
@@ -284,7 +330,7 @@ IMPORTANT: Be thorough - extract ALL visible numbers, not just the prominent one
         structure = {
             "cells": cells_data,
             "numeric_cells": numeric_cells,  # NO LIMITS - include ALL numeric cells
-            "text_cells": text_cells[:100],  # Limit text cells for performance
+            "text_cells": text_cells,  # Limited to 100 text cells for performance
             "formula_cells": formula_cells,
             "high_value_cells": high_value_cells,
             "data_regions": data_regions,
@@ -297,12 +343,12 @@ IMPORTANT: Be thorough - extract ALL visible numbers, not just the prominent one
             "statistics": {
                 "total_cells": len(cells_data),
                 "numeric_cells_count": len(numeric_cells),
-                "text_cells_count": len(text_cells),
+                "text_cells_count": text_cells_count,
                 "formula_cells_count": len(formula_cells)
             }
         }
         
-        logger.info(f"Extracted {len(numeric_cells)} numeric cells, {len(text_cells)} text cells, {len(formula_cells)} formula cells")
+        logger.info(f"Extracted {len(numeric_cells)} numeric cells, {text_cells_count} text cells, {len(formula_cells)} formula cells")
         
         return structure
 
@@ -323,8 +369,10 @@ IMPORTANT: Be thorough - extract ALL visible numbers, not just the prominent one
             )
             all_potential_sources.extend(high_value_sources)
         
-        # Process remaining numeric cells in batches
-        remaining_cells = [cell for cell in numeric_cells if cell not in high_value_cells]
+        # Process remaining numeric cells in batches. Membership goes through a
+        # set of refs; testing `in high_value_cells` compared dicts one by one
+        high_value_refs = {cell["cell_ref"] for cell in high_value_cells}
+        remaining_cells = [cell for cell in numeric_cells if cell["cell_ref"] not in high_value_refs]
         
         batch_size = self.max_cells_per_batch
         total_batches = math.ceil(len(remaining_cells) / batch_size)
@@ -369,23 +417,28 @@ IMPORTANT: Be thorough - extract ALL visible numbers, not just the prominent one
             return []
         
         try:
-            # Prepare batch data for analysis
+            # Prepare batch data for analysis; empty/default attributes are left
+            # out since they only cost prompt tokens
             batch_data = []
             for cell in cells_batch:
-                batch_data.append({
+                cell_data = {
                     "cell_ref": cell["cell_ref"],
                     "value": cell["value"],
-                    "data_type": cell["data_type"],
-                    "formula": cell.get("formula"),
-                    "font_bold": cell.get("font_bold", False),
-                    "number_format": cell.get("number_format")
-                })
+                    "data_type": cell["data_type"]
+                }
+                if cell.get("formula"):
+                    cell_data["formula"] = cell["formula"]
+                if cell.get("font_bold"):
+                    cell_data["font_bold"] = True
+                if cell.get("number_format") not in (None, "General"):
+                    cell_data["number_format"] = cell["number_format"]
+                batch_data.append(cell_data)
             
             prompt = f"""
 Analyze these Excel cells from sheet '{sheet_name}' (batch {batch_index}, type: {batch_type}) to identify values likely to appear in business presentations.
 
 CELLS TO ANALYZE:
-{json.dumps(batch_data, indent=1)}
+{compact_json(batch_data)}
 
 For each cell that could potentially appear in a presentation, determine:
 1. How likely it is to be referenced in presentations (0.0 to 1.0)
@@ -418,8 +471,7 @@ Return ONLY valid JSON:
 Return only valid JSON with comprehensive analysis.
 """
 
-            response = self.model.generate_content(prompt)
-            result = await self._parse_gemini_json_response_robust(response.text, f"excel_batch_{sheet_name}_{batch_index}")
+            result = await self._generate_json(prompt, f"excel_batch_{sheet_name}_{batch_index}")
             
             batch_analysis = result.get('batch_analysis', [])
             
@@ -453,24 +505,20 @@ Return only valid JSON with comprehensive analysis.
         
         high_value_cells = []
         
-        for cell in numeric_cells:
-            score = 0
-            
-            # Large numbers often indicate important metrics
-            abs_value = abs(cell["value"])
-            if abs_value >= 1000000:  # Millions
-                score += 3
-            elif abs_value >= 100000:  # Hundreds of thousands
-                score += 2
-            elif abs_value >= 10000:  # Ten thousands
-                score += 1
-            
+        # Value-based points are scored for the whole sheet at once; only the
+        # formatting checks below need the per-cell dicts
+        abs_values = np.abs(np.fromiter((cell["value"] for cell in numeric_cells), dtype=np.float64, count=len(numeric_cells)))
+        value_scores = (
+            # Large numbers often indicate important metrics: millions 3, hundreds of thousands 2, ten thousands 1
+            (abs_values >= 10000).astype(np.intp) + (abs_values >= 100000) + (abs_values >= 1000000)
             # Round numbers often indicate calculated/summary metrics
-            if abs_value > 0 and abs_value % 1000 == 0:
-                score += 1
-            
-            # Percentages between 0-100 (for growth rates, margins, etc.)
-            if 0 < abs_value <= 100 and cell.get("number_format", "").find("%") != -1:
+            + ((abs_values > 0) & (np.fmod(abs_values, 1000) == 0))
+        )
+        # Percentages between 0-100 (for growth rates, margins, etc.)
+        in_percentage_range = (abs_values > 0) & (abs_values <= 100)
+        
+        for cell, score, percentage_range in zip(numeric_cells, value_scores.tolist(), in_percentage_range.tolist()):
+            if percentage_range and cell.get("number_format", "").find("%") != -1:
                 score += 2
             
             # Bold formatting often indicates important values
@@ -484,7 +532,7 @@ Return only valid JSON with comprehensive analysis.
             
             # Currency formatting indicates financial metrics
             number_format = cell.get("number_format", "")
-            if any(currency_symbol in number_format for currency_symbol in ["$", "€", "£", "¥"]):
+            if CURRENCY_FORMAT_PATTERN.search(number_format):
                 score += 2
             
             # Formula cells might be calculated KPIs
@@ -502,68 +550,66 @@ Return only valid JSON with comprehensive analysis.
         # Return top candidates (but still allow many)
         return high_value_cells[:500]  # Much higher limit than before
 
-    def _detect_comprehensive_data_regions(self, cells_data: Dict, max_row: int, max_col: int) -> List[Dict]:
+    def _detect_comprehensive_data_regions(self, cells_data: Dict, occupied: np.ndarray) -> List[Dict]:
         """Detect data regions in the sheet for better context understanding"""
         
         regions = []
-        processed_cells = set()
+        max_row, max_col = occupied.shape
+        processed = np.zeros_like(occupied)
         
         # Look for rectangular data regions
-        for start_row in range(1, min(max_row, 200), 10):  # Sample every 10 rows
-            for start_col in range(1, min(max_col, 50), 5):   # Sample every 5 columns
+        start_rows = range(1, min(max_row, 200), 10)  # Sample every 10 rows
+        start_cols = range(1, min(max_col, 50), 5)    # Sample every 5 columns
+        # Regions span at most 20x15 cells; skip starts that cannot reach 6
+        window_counts = region_window_counts(occupied, start_rows, start_cols, 20, 15)
+        for i, start_row in enumerate(start_rows):
+            for j, start_col in enumerate(start_cols):
                 
-                if f"{start_col}_{start_row}" in processed_cells:
+                if window_counts[i, j] < 6 or processed[start_row - 1, start_col - 1]:
                     continue
                 
-                region = self._analyze_data_region(cells_data, start_row, start_col, max_row, max_col)
+                region = self._analyze_data_region(cells_data, occupied, start_row, start_col)
                 
                 if region and region["cell_count"] >= 6:  # Minimum table size
                     regions.append(region)
                     
                     # Mark cells as processed
-                    for row in range(region["start_row"], region["end_row"] + 1):
-                        for col in range(region["start_col"], region["end_col"] + 1):
-                            processed_cells.add(f"{col}_{row}")
+                    processed[region["start_row"] - 1:region["end_row"], region["start_col"] - 1:region["end_col"]] = True
         
         return regions
 
-    def _analyze_data_region(self, cells_data: Dict, start_row: int, start_col: int, max_row: int, max_col: int) -> Dict[str, Any]:
+    def _analyze_data_region(self, cells_data: Dict, occupied: np.ndarray, start_row: int, start_col: int) -> Dict[str, Any]:
         """Analyze a potential data region"""
-        import openpyxl
-        
-        region_cells = []
-        end_row = start_row
-        end_col = start_col
-        
-        # Expand region to find contiguous data
-        for row in range(start_row, min(start_row + 20, max_row + 1)):
-            row_has_data = False
-            for col in range(start_col, min(start_col + 15, max_col + 1)):
-                cell_ref = f"{openpyxl.utils.get_column_letter(col)}{row}"
-                if cell_ref in cells_data:
-                    region_cells.append({
-                        "cell_ref": cell_ref,
-                        "value": cells_data[cell_ref]["value"],
-                        "row": row,
-                        "col": col
-                    })
-                    row_has_data = True
-                    end_row = max(end_row, row)
-                    end_col = max(end_col, col)
+        # Expand region to find contiguous data, stopping at the first row with
+        # no data; cell entries are only built for the sample of a kept region
+        window = occupied[start_row - 1:start_row + 19, start_col - 1:start_col + 14]
+        row_offsets, col_offsets = region_cell_offsets(window, 0)
+        cell_count = int(row_offsets.size)
+        
+        if cell_count >= 6:
+            end_row = start_row + int(row_offsets.max())
+            end_col = start_col + int(col_offsets.max())
+            region_cells = []
+            # Sample of cells for context
+            for row_offset, col_offset in zip(row_offsets[:50].tolist(), col_offsets[:50].tolist()):
+                row = start_row + row_offset
+                col = start_col + col_offset
+                cell_ref = f"{COLUMN_LETTERS[col - 1]}{row}"
+                region_cells.append({
+                    "cell_ref": cell_ref,
+                    "value": cells_data[cell_ref]["value"],
+                    "row": row,
+                    "col": col
+                })
             
-            # If row has no data, stop expanding
-            if not row_has_data and len(region_cells) > 0:
-                break
-        
-        if len(region_cells) >= 6:
             return {
                 "start_row": start_row,
                 "start_col": start_col,
                 "end_row": end_row,
                 "end_col": end_col,
-                "cell_count": len(region_cells),
-                "cells": region_cells[:50],  # Sample of cells for context
-                "density": len(region_cells) / ((end_row - start_row + 1) * (end_col - start_col + 1))
+                "cell_count": cell_count,
+                "cells": region_cells,
+                "density": cell_count / ((end_row - start_row + 1) * (end_col - start_col + 1))
             }
         
         return None
@@ -577,14 +623,18 @@ Return only valid JSON with comprehensive analysis.
             
             # Create comprehensive statistics
             total_sources = len(all_potential_sources)
-            high_likelihood_sources = len([s for s in all_potential_sources if s.get("presentation_likelihood", 0) >= 0.7])
-            medium_likelihood_sources = len([s for s in all_potential_sources if 0.4 <= s.get("presentation_likelihood", 0) < 0.7])
+            high_likelihood_sources = 0
+            medium_likelihood_sources = 0
+            category_breakdown = Counter()
             
-            # Group by data categories
-            category_breakdown = {}
+            # Likelihood buckets and data categories in one pass
             for source in all_potential_sources:
-                category = source.get("value_category", "unknown")
-                category_breakdown[category] = category_breakdown.get(category, 0) + 1
+                likelihood = source.get("presentation_likelihood", 0)
+                if likelihood >= 0.7:
+                    high_likelihood_sources += 1
+                elif likelihood >= 0.4:
+                    medium_likelihood_sources += 1
+                category_breakdown[source.get("value_category", "unknown")] += 1
             
             workbook_summary = {
                 "workbook_summary": {
@@ -592,7 +642,7 @@ Return only valid JSON with comprehensive analysis.
                     "total_potential_sources": total_sources,
                     "high_likelihood_sources": high_likelihood_sources,
                     "medium_likelihood_sources": medium_likelihood_sources,
-                    "category_breakdown": category_breakdown,
+                    "category_breakdown": dict(category_breakdown),
                     "analysis_timestamp": datetime.utcnow().isoformat(),
                     "comprehensive_extraction": True,
                     "coverage": "FULL - No artificial limits applied"
@@ -651,22 +701,39 @@ Return only valid JSON with comprehensive analysis.
         
         # Process PDF values in smaller batches for better reliability
         batch_size = 5  # Reduced batch size for better JSON reliability
-        all_audit_results = []
-        
-        for i in range(0, len(pdf_values), batch_size):
-            batch = pdf_values[i:i+batch_size]
-            batch_results = await self._process_direct_audit_batch(batch, excel_values, i // batch_size + 1)
-            all_audit_results.extend(batch_results)
-            await asyncio.sleep(1)  # Rate limiting
-        
-        # Calculate comprehensive summary
+        batches = [pdf_values[i:i+batch_size] for i in range(0, len(pdf_values), batch_size)]
+        
+        # Independent Gemini calls, so run several at once; the semaphore and the
+        # pause before releasing a slot keep us within the rate limit
+        semaphore = asyncio.Semaphore(self.max_concurrent_audit_batches)
+        
+        # Every batch searches the same Excel values: only the fields the model
+        # matches on, within a token budget, serialized once for all batches
+        excel_prompt_json = compact_json(self._fit_prompt_budget(
+            self._compact_for_prompt(excel_values[:100], AUDIT_EXCEL_PROMPT_FIELDS),
+            self.max_audit_prompt_tokens
+        ))
+        
+        async def run_batch(batch, batch_num):
+            async with semaphore:
+                batch_results = await self._process_direct_audit_batch(batch, excel_prompt_json, batch_num)
+                await asyncio.sleep(1)  # Rate limiting
+                return batch_results
+        
+        results_per_batch = await asyncio.gather(
+            *(run_batch(batch, batch_num) for batch_num, batch in enumerate(batches, 1))
+        )
+        all_audit_results = [result for batch_results in results_per_batch for result in batch_results]
+        
+        # Calculate comprehensive summary from a single pass over the results
+        status_counts = Counter(r.get("validation_status") for r in all_audit_results)
         summary = {
             "total_values_checked": len(all_audit_results),
-            "matched": len([r for r in all_audit_results if r.get("validation_status") == "matched"]),
-            "mismatched": len([r for r in all_audit_results if r.get("validation_status") == "mismatched"]),
-            "formatting_differences": len([r for r in all_audit_results if r.get("validation_status") == "formatting_difference"]),
-            "unverifiable": len([r for r in all_audit_results if r.get("validation_status") == "unverifiable"]),
-            "pdf_only": len([r for r in all_audit_results if r.get("validation_status") == "pdf_only"]),
+            "matched": status_counts["matched"],
+            "mismatched": status_counts["mismatched"],
+            "formatting_differences": status_counts["formatting_difference"],
+            "unverifiable": status_counts["unverifiable"],
+            "pdf_only": status_counts["pdf_only"],
         }
         
         if summary["total_values_checked"] > 0:
@@ -690,20 +757,19 @@ Return only valid JSON with comprehensive analysis.
             }
         }
 
-    async def _process_direct_audit_batch(self, pdf_batch: List[Dict], all_excel_values: List[Dict], batch_num: int) -> List[Dict]:
-        """Process a batch of PDF values against all Excel values"""
+    async def _process_direct_audit_batch(self, pdf_batch: List[Dict], excel_prompt_json: str, batch_num: int) -> List[Dict]:
+        """Process a batch of PDF values against the serialized Excel sample"""
         
-        # Use MORE Excel values for comprehensive comparison (remove the 30 limit)
-        excel_sample = all_excel_values[:100] if len(all_excel_values) > 100 else all_excel_values
+        pdf_prompt_values = self._compact_for_prompt(pdf_batch, AUDIT_PDF_PROMPT_FIELDS)
         
         prompt = f"""
 You are auditing presentation values against Excel source data.
 
 PDF VALUES TO VALIDATE (Batch {batch_num}):
-{json.dumps(pdf_batch, indent=1)}
+{compact_json(pdf_prompt_values)}
 
 EXCEL VALUES TO SEARCH AGAINST:
-{json.dumps(excel_sample, indent=1)}
+{excel_prompt_json}
 
 For each PDF value, find its best match in Excel values and determine validation status.
 
@@ -738,8 +804,7 @@ Return ONLY valid JSON.
 """
 
         try:
-            response = self.model.generate_content(prompt)
-            result = await self._parse_gemini_json_response_robust(response.text, f"direct_audit_batch_{batch_num}")
+            result = await self._generate_json(prompt, f"direct_audit_batch_{batch_num}")
             
             batch_results = result.get('batch_results', [])
             
@@ -863,7 +928,7 @@ Create a document summary in JSON format:
         "document_type": "financial_presentation",
         "main_business_themes": ["revenue", "growth", "performance"]
     }},
-    "all_extracted_values": {json.dumps(all_values[:100])},
+    "all_extracted_values": {compact_json(all_values[:100])},
     "extraction_quality_metrics": {{
         "total_values_extracted": {len(all_values)},
         "overall_confidence": 0.85
@@ -873,8 +938,7 @@ Create a document summary in JSON format:
 Return only valid JSON.
 """
 
-            response = self.model.generate_content(prompt)
-            synthesis = await self._parse_gemini_json_response_robust(response.text, "document_synthesis")
+            synthesis = await self._generate_json(prompt, "document_synthesis")
             
             # Ensure all_extracted_values is populated
             if not synthesis.get('all_extracted_values'):
@@ -936,6 +1000,80 @@ Return only valid JSON.
         
         return result
 
+    @staticmethod
+    def _compact_for_prompt(values: List[Dict], fields: Tuple[str, ...]) -> List[Dict]:
+        """Project values onto the given fields, dropping empty ones"""
+        return [
+            {field: value[field] for field in fields if value.get(field) not in (None, "", [], {})}
+            for value in values
+        ]
+
+    @staticmethod
+    def _fit_prompt_budget(values: List[Dict], max_tokens: int) -> List[Dict]:
+        """Keep leading values until their estimated token count reaches max_tokens"""
+        budget = max_tokens * CHARS_PER_TOKEN
+        for i, value in enumerate(values):
+            budget -= len(compact_json(value))
+            if budget < 0:
+                logger.info(f"Prompt budget reached, sending {i} of {len(values)} values")
+                return values[:i]
+        return values
+
+    async def _cached_file_extraction(self, kind: str, path: str, extract) -> Dict[str, Any]:
+        """Run extract(path) once per file content; identical re-uploads reuse the stored result"""
+        digest = await asyncio.to_thread(file_fingerprint, path)
+        cache_key = ai_response_cache.key_for(f"{self.model.model_name}:{kind}", digest)
+        cached = await ai_response_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Reusing {kind} for unchanged file: {path}")
+            return orjson.loads(cached)
+
+        result = await extract(path)
+        if not self._is_degraded_extraction(result):  # do not pin a degraded fallback result
+            await ai_response_cache.set(cache_key, compact_json(result))
+        return result
+
+    @staticmethod
+    def _is_degraded_extraction(result: Dict[str, Any]) -> bool:
+        """True when a page, cell batch or the synthesis fell back after an error"""
+        return (
+            "synthesis_error" in result
+            or bool(result.get("failed_pages"))
+            or any("error" in source for source in result.get("potential_sources", []))
+        )
+
+    async def _generate_json(self, contents, context: str) -> Dict[str, Any]:
+        """Parsed JSON of a Gemini completion; only replies that parse cleanly are cached"""
+        # Identical prompts and page images (re-uploads of unchanged documents) are
+        # served from cache instead of another Gemini round-trip
+        parts = contents if isinstance(contents, list) else [contents]
+        key_parts = []
+        for part in parts:
+            if isinstance(part, Image.Image):
+                key_parts.append(f"image:{part.mode}:{part.width}x{part.height}")
+                key_parts.append(part.tobytes())
+            else:
+                key_parts.append(part)
+        cache_key = ai_response_cache.key_for(self.model.model_name, *key_parts)
+        cached = await ai_response_cache.get(cache_key)
+        if cached is not None:
+            return await self._parse_gemini_json_response_robust(cached, context)
+
+        response_text = await self._generate_text(contents)
+        result = await self._parse_gemini_json_response_robust(response_text, context)
+        if "error" not in result:  # truncated or malformed replies are retried next time
+            await ai_response_cache.set(cache_key, response_text)
+        return result
+
+    async def _generate_text(self, contents) -> str:
+        """Stream a Gemini completion without blocking the event loop and return the joined text"""
+        response = await self.model.generate_content_async(contents, stream=True)
+        chunks = []
+        async for chunk in response:
+            if chunk.parts:  # the closing chunk may carry only finish metadata
+                chunks.append(chunk.text)
+        return "".join(chunks)
+
     async def _parse_gemini_json_response_robust(self, response_text: str, context: str) -> Dict[str, Any]:
         """Robust JSON parsing for Gemini responses with multiple fallback strategies"""
         try:
@@ -1083,4 +1221,8 @@ Return only valid JSON.
             }
 
 # Initialize the enhanced service
-enhanced_gemini_service = EnhancedGeminiService()
\ No newline at end of file
+enhanced_gemini_service = EnhancedGeminiService()
+
+def extract_workbook_structures(excel_path: str) -> Tuple[int, List[Tuple[str, Dict[str, Any]]]]:
+    """Module-level entry point so workbook parsing can be shipped to the parse process pool"""
+    return enhanced_gemini_service._extract_workbook_structures(excel_path)
\ No newline at end of file
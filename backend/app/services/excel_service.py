@@ -1,14 +1,82 @@
 import openpyxl
+from openpyxl.utils import get_column_letter
+import numpy as np
 import pandas as pd
 from typing import Dict, Any, List, Optional, Tuple
 import structlog
+import asyncio
 from io import BytesIO
 import json
 import re
 from datetime import datetime
+from functools import lru_cache
 
 logger = structlog.get_logger()
 
+# Keyword scans compiled once into single alternations, so each cell is matched
+# in one pass by the regex engine instead of a Python loop over every keyword
+SUMMARY_KEYWORDS = ("total", "sum", "revenue", "profit", "loss", "net", "gross", "ebitda")
+SUMMARY_KEYWORD_PATTERN = re.compile("|".join(SUMMARY_KEYWORDS), re.IGNORECASE)
+CURRENCY_FORMAT_PATTERN = re.compile(r"[$€£¥₹]")
+DATE_FORMAT_PATTERN = re.compile(r"yyyy|mm|dd|date", re.IGNORECASE)
+
+# Letters for every Excel column (A..XFD); cell loops index this, COLUMN_LETTERS[col - 1]
+COLUMN_LETTERS = tuple(get_column_letter(col) for col in range(1, 16385))
+
+def sheet_extent(sheet) -> Tuple[int, int]:
+    """(max_row, max_column) of a sheet, at least 1x1.
+
+    Read-only sheets saved without a dimension record are measured with one
+    values-only pass; openpyxl's own calculate_dimension(force=True) fails on
+    such a sheet when it is empty.
+    """
+    if sheet.max_row is not None and sheet.max_column is not None:
+        return sheet.max_row or 1, sheet.max_column or 1
+    max_row = max_col = 0
+    for row_number, row in enumerate(sheet.iter_rows(values_only=True), 1):
+        if row:
+            max_row = row_number
+            max_col = max(max_col, len(row))
+    return max_row or 1, max_col or 1
+
+def region_window_counts(occupied: np.ndarray, start_rows: range, start_cols: range, height: int, width: int) -> np.ndarray:
+    """Occupied-cell count of the height x width window at every (start_row, start_col), clipped to the grid.
+
+    Starts are 1-based like the sheet. Uses one summed-area table, so a region
+    scan can skip starts that could never reach its minimum cell count.
+    """
+    n_rows, n_cols = occupied.shape
+    table = np.zeros((n_rows + 1, n_cols + 1), dtype=np.int64)
+    table[1:, 1:] = occupied.cumsum(axis=0).cumsum(axis=1)
+    top = np.asarray(start_rows, dtype=np.intp) - 1
+    left = np.asarray(start_cols, dtype=np.intp) - 1
+    bottom = np.minimum(top + height, n_rows)
+    right = np.minimum(left + width, n_cols)
+    return (
+        table[np.ix_(bottom, right)] - table[np.ix_(top, right)]
+        - table[np.ix_(bottom, left)] + table[np.ix_(top, left)]
+    )
+
+def region_cell_offsets(window: np.ndarray, min_cells_before_gap: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(row offsets, col offsets) of the occupied cells in a region grown down its window, in row-major order.
+
+    Growth stops at the first empty row once more than min_cells_before_gap
+    cells are held. Counting and extent come straight from the arrays, so
+    callers only build cell entries for regions that survive.
+    """
+    row_counts = window.sum(axis=1)
+    gaps = np.flatnonzero((row_counts == 0) & (np.cumsum(row_counts) > min_cells_before_gap))
+    return np.nonzero(window[:gaps[0]] if gaps.size else window)
+
+@lru_cache(maxsize=512)
+def _classify_number_format(number_format: str) -> Tuple[bool, bool, bool]:
+    """(is_percentage, is_currency, is_date) for a number format; workbooks reuse a handful of formats"""
+    return (
+        "%" in number_format,
+        CURRENCY_FORMAT_PATTERN.search(number_format) is not None,
+        DATE_FORMAT_PATTERN.search(number_format) is not None
+    )
+
 class ComprehensiveExcelService:
     def __init__(self):
         # Configuration for comprehensive extraction
@@ -24,11 +92,10 @@ class ComprehensiveExcelService:
         logger.info("Starting COMPREHENSIVE Excel data extraction - no artificial limits")
         
         try:
-            # Load workbook with comprehensive settings
-            workbook = openpyxl.load_workbook(BytesIO(file_content), data_only=True, read_only=False)
-            workbook_with_formulas = openpyxl.load_workbook(BytesIO(file_content), data_only=False, read_only=False)
+            # Load and walk the workbook in a worker thread; read-only workbooks parse
+            # their XML while rows are iterated, so both steps block
+            total_sheets, walked_sheets = await asyncio.to_thread(self._read_workbook, file_content)
             
-            total_sheets = len(workbook.sheetnames)
             sheets_to_process = min(total_sheets, self.max_sheets_to_process)
             
             logger.info(f"Processing {sheets_to_process} sheets out of {total_sheets} total sheets")
@@ -44,14 +111,14 @@ class ComprehensiveExcelService:
                 "sheets_skipped": 0
             }
             
-            for sheet_name in workbook.sheetnames[:sheets_to_process]:
+            for sheet_name, sheet_walk in walked_sheets.items():
                 try:
                     logger.info(f"Processing sheet: {sheet_name}")
                     
-                    sheet = workbook[sheet_name]
-                    sheet_with_formulas = workbook_with_formulas[sheet_name]
+                    if isinstance(sheet_walk, Exception):
+                        raise sheet_walk
                     
-                    sheet_data = await self._extract_comprehensive_sheet_data(sheet, sheet_with_formulas, sheet_name)
+                    sheet_data = await self._extract_comprehensive_sheet_data(sheet_walk, sheet_name)
                     sheets_data[sheet_name] = sheet_data
                     
                     # Update statistics
@@ -67,9 +134,6 @@ class ComprehensiveExcelService:
                     # Continue with other sheets instead of failing completely
                     continue
             
-            workbook.close()
-            workbook_with_formulas.close()
-            
             result = {
                 "sheets": sheets_data,
                 "metadata": {
@@ -95,13 +159,42 @@ class ComprehensiveExcelService:
             logger.error(f"Comprehensive Excel extraction failed: {e}")
             raise
     
-    async def _extract_comprehensive_sheet_data(self, sheet, sheet_with_formulas, sheet_name: str) -> Dict[str, Any]:
+    @staticmethod
+    def _load_workbooks(file_content: bytes):
+        """Open the workbook for cached values and for formulas.
+
+        Both are read-only (streamed) workbooks, which parse a fraction of what a
+        full load does and are only ever walked once, row by row.
         """
-        Extract comprehensive data from a single sheet - NO ARTIFICIAL LIMITS
+        workbook = openpyxl.load_workbook(BytesIO(file_content), data_only=True, read_only=True, keep_links=False)
+        workbook_with_formulas = openpyxl.load_workbook(BytesIO(file_content), data_only=False, read_only=True, keep_links=False)
+        return workbook, workbook_with_formulas
+    
+    def _read_workbook(self, file_content: bytes):
+        """Load the workbook and walk the cells of every sheet to be processed.
+
+        Runs in a worker thread. Returns the total sheet count and, per sheet name,
+        either the walked cells or the exception that stopped that sheet.
         """
+        workbook, workbook_with_formulas = self._load_workbooks(file_content)
+        try:
+            walked_sheets = {}
+            for sheet_name in workbook.sheetnames[:self.max_sheets_to_process]:
+                try:
+                    walked_sheets[sheet_name] = self._walk_sheet_cells(
+                        workbook[sheet_name], workbook_with_formulas[sheet_name], sheet_name
+                    )
+                except Exception as sheet_error:
+                    walked_sheets[sheet_name] = sheet_error
+            return len(workbook.sheetnames), walked_sheets
+        finally:
+            workbook.close()
+            workbook_with_formulas.close()
+    
+    def _walk_sheet_cells(self, sheet, sheet_with_formulas, sheet_name: str) -> Dict[str, Any]:
+        """Read and categorize every non-empty cell of a sheet within the processing limits"""
         # Get ACTUAL sheet dimensions
-        actual_max_row = sheet.max_row or 1
-        actual_max_col = sheet.max_column or 1
+        actual_max_row, actual_max_col = sheet_extent(sheet)
         
         # Apply reasonable limits for memory management only
         effective_max_row = min(actual_max_row, self.max_rows_per_sheet)
@@ -117,37 +210,74 @@ class ComprehensiveExcelService:
         date_cells = []
         percentage_cells = []
         currency_cells = []
-        
-        # Process ALL cells in the effective range
-        for row in range(1, effective_max_row + 1):
-            for col in range(1, effective_max_col + 1):
+        # Which grid positions hold a cell, so region scans probe an array
+        # instead of building "A1" keys for every empty position
+        occupied = np.zeros((effective_max_row, effective_max_col), dtype=bool)
+        
+        # Process ALL cells in the effective range. Rows are walked with iter_rows
+        # (much cheaper than cell() per coordinate), and the formula sheet only
+        # contributes its raw values alongside
+        value_rows = sheet.iter_rows(max_row=effective_max_row, max_col=effective_max_col)
+        formula_rows = sheet_with_formulas.iter_rows(max_row=effective_max_row, max_col=effective_max_col, values_only=True)
+        for row, (cells, formula_values) in enumerate(zip(value_rows, formula_rows), start=1):
+            for col, (cell, formula_value) in enumerate(zip(cells, formula_values), start=1):
+                if cell.value is None:
+                    continue
                 try:
-                    cell = sheet.cell(row, col)
+                    cell_ref = f"{COLUMN_LETTERS[col - 1]}{row}"
+                    
+                    # Extract comprehensive cell information
+                    cell_info = self._extract_comprehensive_cell_info(cell, formula_value, row, col)
                     
-                    if cell.value is not None:
-                        cell_ref = f"{openpyxl.utils.get_column_letter(col)}{row}"
-                        
-                        # Extract comprehensive cell information
-                        cell_info = await self._extract_comprehensive_cell_info(cell, sheet_with_formulas.cell(row, col), row, col)
-                        
-                        cells_data[cell_ref] = cell_info
-                        
-                        # Categorize cells comprehensively
-                        await self._categorize_cell_comprehensive(cell_info, cell_ref, numeric_cells, text_cells, formula_cells, date_cells, percentage_cells, currency_cells)
+                    cells_data[cell_ref] = cell_info
+                    occupied[row - 1, col - 1] = True
+                    
+                    # Categorize cells comprehensively
+                    self._categorize_cell_comprehensive(cell_info, cell_ref, numeric_cells, text_cells, formula_cells, date_cells, percentage_cells, currency_cells)
                 
                 except Exception as cell_error:
                     # Log but continue processing other cells
                     logger.debug(f"Error processing cell {col},{row} in sheet {sheet_name}: {cell_error}")
                     continue
         
+        return {
+            "cells_data": cells_data,
+            "occupied": occupied,
+            "numeric_cells": numeric_cells,
+            "text_cells": text_cells,
+            "formula_cells": formula_cells,
+            "date_cells": date_cells,
+            "percentage_cells": percentage_cells,
+            "currency_cells": currency_cells,
+            "actual_max_row": actual_max_row,
+            "actual_max_col": actual_max_col,
+            "effective_max_row": effective_max_row,
+            "effective_max_col": effective_max_col,
+        }
+    
+    async def _extract_comprehensive_sheet_data(self, sheet_walk: Dict[str, Any], sheet_name: str) -> Dict[str, Any]:
+        """
+        Extract comprehensive data from a single walked sheet - NO ARTIFICIAL LIMITS
+        """
+        cells_data = sheet_walk["cells_data"]
+        occupied = sheet_walk["occupied"]
+        numeric_cells = sheet_walk["numeric_cells"]
+        text_cells = sheet_walk["text_cells"]
+        formula_cells = sheet_walk["formula_cells"]
+        date_cells = sheet_walk["date_cells"]
+        percentage_cells = sheet_walk["percentage_cells"]
+        currency_cells = sheet_walk["currency_cells"]
+        actual_max_row, actual_max_col = sheet_walk["actual_max_row"], sheet_walk["actual_max_col"]
+        effective_max_row, effective_max_col = sheet_walk["effective_max_row"], sheet_walk["effective_max_col"]
+        
         # Detect comprehensive data patterns
-        data_regions = await self._detect_comprehensive_data_regions(cells_data, effective_max_row, effective_max_col)
+        data_regions = await self._detect_comprehensive_data_regions(cells_data, occupied)
         
         # Identify high-priority cells (KPIs, summary metrics, etc.)
         high_priority_cells = await self._identify_high_priority_cells(numeric_cells, text_cells, formula_cells)
         
         # Analyze data relationships and patterns
-        data_patterns = await self._analyze_data_patterns(cells_data, data_regions)
+        data_patterns = await self._analyze_data_patterns(cells_data, data_regions, text_cells, numeric_cells)
         
         # Create comprehensive sheet analysis
         sheet_data = {
@@ -194,7 +324,7 @@ class ComprehensiveExcelService:
         
         return sheet_data
     
-    async def _extract_comprehensive_cell_info(self, cell, formula_cell, row: int, col: int) -> Dict[str, Any]:
+    def _extract_comprehensive_cell_info(self, cell, formula_value: Any, row: int, col: int) -> Dict[str, Any]:
         """Extract comprehensive information about a single cell"""
         
         cell_info = {
@@ -202,15 +332,15 @@ class ComprehensiveExcelService:
             "data_type": type(cell.value).__name__,
             "row": row,
             "col": col,
-            "coordinate": f"{openpyxl.utils.get_column_letter(col)}{row}"
+            "coordinate": f"{COLUMN_LETTERS[col - 1]}{row}"
         }
         
         # Number formatting information
         if hasattr(cell, 'number_format') and cell.number_format:
             cell_info["number_format"] = cell.number_format
-            cell_info["is_percentage"] = '%' in cell.number_format
-            cell_info["is_currency"] = any(symbol in cell.number_format for symbol in ['$', '€', '£', '¥', '₹'])
-            cell_info["is_date"] = any(fmt in cell.number_format.lower() for fmt in ['yyyy', 'mm', 'dd', 'date'])
+            (cell_info["is_percentage"],
+             cell_info["is_currency"],
+             cell_info["is_date"]) = _classify_number_format(cell.number_format)
         
         # Font and styling information
         if hasattr(cell, 'font') and cell.font:
@@ -231,12 +361,12 @@ class ComprehensiveExcelService:
             cell_info["has_fill"] = getattr(cell.fill, 'start_color', None) is not None
         
         # Formula information
-        if formula_cell and str(formula_cell.value).startswith('='):
-            cell_info["formula"] = str(formula_cell.value)
+        if isinstance(formula_value, str) and formula_value.startswith('='):
+            cell_info["formula"] = formula_value
             cell_info["is_calculated"] = True
             
             # Analyze formula complexity
-            formula_str = str(formula_cell.value)
+            formula_str = formula_value
             cell_info["formula_complexity"] = {
                 "has_sum": "SUM" in formula_str.upper(),
                 "has_average": "AVERAGE" in formula_str.upper(),
@@ -271,7 +401,7 @@ class ComprehensiveExcelService:
         
         return cell_info
     
-    async def _categorize_cell_comprehensive(self, cell_info: Dict, cell_ref: str, 
+    def _categorize_cell_comprehensive(self, cell_info: Dict, cell_ref: str, 
                                            numeric_cells: List, text_cells: List, formula_cells: List,
                                            date_cells: List, percentage_cells: List, currency_cells: List):
         """Comprehensively categorize cells based on their characteristics"""
@@ -411,49 +541,65 @@ class ComprehensiveExcelService:
         
         return score
     
-    async def _detect_comprehensive_data_regions(self, cells_data: Dict, max_row: int, max_col: int) -> List[Dict]:
+    async def _detect_comprehensive_data_regions(self, cells_data: Dict, occupied: np.ndarray) -> List[Dict]:
         """Detect comprehensive data regions (tables, summary areas, etc.)"""
         
         regions = []
-        processed_areas = set()
+        max_row, max_col = occupied.shape
+        processed = np.zeros_like(occupied)
         
         # Scan for data regions more comprehensively
-        for start_row in range(1, min(max_row, 500), 15):  # Sample every 15 rows
-            for start_col in range(1, min(max_col, 50), 8):   # Sample every 8 columns
+        start_rows = range(1, min(max_row, 500), 15)  # Sample every 15 rows
+        start_cols = range(1, min(max_col, 50), 8)    # Sample every 8 columns
+        # A region grows at most 30x25 from its start, so starts whose window
+        # holds fewer than 9 cells cannot produce one and are never expanded
+        window_counts = region_window_counts(occupied, start_rows, start_cols, 30, 25)
+        for i, start_row in enumerate(start_rows):
+            for j, start_col in enumerate(start_cols):
                 
-                region_key = f"{start_row}_{start_col}"
-                if region_key in processed_areas:
+                if window_counts[i, j] < 9 or processed[start_row - 1, start_col - 1]:
                     continue
                 
-                region = await self._analyze_comprehensive_data_region(cells_data, start_row, start_col, max_row, max_col)
+                region = await self._analyze_comprehensive_data_region(cells_data, occupied, start_row, start_col)
                 
                 if region and region["cell_count"] >= 9:  # Minimum meaningful region size
                     regions.append(region)
                     
                     # Mark area as processed
-                    for row in range(region["start_row"], min(region["end_row"] + 1, max_row + 1)):
-                        for col in range(region["start_col"], min(region["end_col"] + 1, max_col + 1)):
-                            processed_areas.add(f"{row}_{col}")
+                    processed[region["start_row"] - 1:region["end_row"], region["start_col"] - 1:region["end_col"]] = True
         
         return regions
     
-    async def _analyze_comprehensive_data_region(self, cells_data: Dict, start_row: int, start_col: int, max_row: int, max_col: int) -> Optional[Dict]:
+    async def _analyze_comprehensive_data_region(self, cells_data: Dict, occupied: np.ndarray, start_row: int, start_col: int) -> Optional[Dict]:
         """Analyze a potential comprehensive data region"""
         
-        region_cells = []
-        numeric_cells_in_region = []
-        text_cells_in_region = []
-        
-        # Expand region to find contiguous data
-        end_row = start_row
-        end_col = start_col
+        # Expand region to find contiguous data over larger, wider regions; a row
+        # with no data ends the region once it holds some data. Slicing clips at
+        # the sheet edge
+        window = occupied[start_row - 1:start_row + 29, start_col - 1:start_col + 24]
+        row_offsets, col_offsets = region_cell_offsets(window, 6)
+        cell_count = int(row_offsets.size)
         
-        for row in range(start_row, min(start_row + 30, max_row + 1)):  # Larger regions
-            row_has_data = False
-            for col in range(start_col, min(start_col + 25, max_col + 1)):  # Wider regions
-                cell_ref = f"{openpyxl.utils.get_column_letter(col)}{row}"
-                if cell_ref in cells_data:
-                    cell_data = cells_data[cell_ref]
+        if cell_count >= 9:  # Minimum meaningful region
+            end_row = start_row + int(row_offsets.max())
+            end_col = start_col + int(col_offsets.max())
+            
+            region_cells = []
+            numeric_cells_count = 0
+            text_cells_count = 0
+            for row_offset, col_offset in zip(row_offsets.tolist(), col_offsets.tolist()):
+                row = start_row + row_offset
+                col = start_col + col_offset
+                cell_ref = f"{COLUMN_LETTERS[col - 1]}{row}"
+                cell_data = cells_data[cell_ref]
+                
+                if isinstance(cell_data["value"], (int, float)):
+                    numeric_cells_count += 1
+                elif isinstance(cell_data["value"], str):
+                    text_cells_count += 1
+                
+                # Sample of cells for analysis
+                if len(region_cells) < 100:
                     region_cells.append({
                         "cell_ref": cell_ref,
                         "value": cell_data["value"],
@@ -461,44 +607,29 @@ class ComprehensiveExcelService:
                         "col": col,
                         "data_type": cell_data["data_type"]
                     })
-                    
-                    if isinstance(cell_data["value"], (int, float)):
-                        numeric_cells_in_region.append(cell_data)
-                    elif isinstance(cell_data["value"], str):
-                        text_cells_in_region.append(cell_data)
-                    
-                    row_has_data = True
-                    end_row = max(end_row, row)
-                    end_col = max(end_col, col)
             
-            # If row has no data and we have some data, consider ending the region
-            if not row_has_data and len(region_cells) > 6:
-                break
-        
-        if len(region_cells) >= 9:  # Minimum meaningful region
             region_analysis = {
                 "start_row": start_row,
                 "start_col": start_col,
                 "end_row": end_row,
                 "end_col": end_col,
-                "cell_count": len(region_cells),
-                "numeric_cells_count": len(numeric_cells_in_region),
-                "text_cells_count": len(text_cells_in_region),
-                "cells": region_cells[:100],  # Sample of cells for analysis
-                "density": len(region_cells) / ((end_row - start_row + 1) * (end_col - start_col + 1)),
-                "region_type": await self._classify_region_type(region_cells, numeric_cells_in_region, text_cells_in_region)
+                "cell_count": cell_count,
+                "numeric_cells_count": numeric_cells_count,
+                "text_cells_count": text_cells_count,
+                "cells": region_cells,
+            "density": cell_count / ((end_row - start_row + 1) * (end_col - start_col + 1)),
+                "region_type": await self._classify_region_type(cell_count, numeric_cells_count, text_cells_count)
             }
             
             return region_analysis
         
         return None
     
-    async def _classify_region_type(self, region_cells: List, numeric_cells: List, text_cells: List) -> str:
+    async def _classify_region_type(self, total_cells: int, numeric_cells_count: int, text_cells_count: int) -> str:
         """Classify the type of data region"""
         
-        total_cells = len(region_cells)
-        numeric_ratio = len(numeric_cells) / total_cells if total_cells > 0 else 0
-        text_ratio = len(text_cells) / total_cells if total_cells > 0 else 0
+        numeric_ratio = numeric_cells_count / total_cells if total_cells > 0 else 0
+        text_ratio = text_cells_count / total_cells if total_cells > 0 else 0
         
         if numeric_ratio > 0.8:
             return "numeric_table"
@@ -511,7 +642,7 @@ class ComprehensiveExcelService:
         else:
             return "general_data_region"
     
-    async def _analyze_data_patterns(self, cells_data: Dict, data_regions: List) -> Dict[str, Any]:
+    async def _analyze_data_patterns(self, cells_data: Dict, data_regions: List, text_cells: List, numeric_cells: List) -> Dict[str, Any]:
         """Analyze patterns in the data for better understanding"""
         
         patterns = {
@@ -561,38 +692,37 @@ class ComprehensiveExcelService:
                 })
         
         # Identify summary indicators
-        patterns["summary_indicators"] = await self._identify_summary_indicators(cells_data)
+        patterns["summary_indicators"] = await self._identify_summary_indicators(text_cells, numeric_cells)
         
         return patterns
     
-    async def _identify_summary_indicators(self, cells_data: Dict) -> List[Dict]:
+    async def _identify_summary_indicators(self, text_cells: List, numeric_cells: List) -> List[Dict]:
         """Identify cells that appear to be summary/total indicators"""
         
         summary_indicators = []
         
-        for cell_ref, cell_info in cells_data.items():
-            value = cell_info.get("value")
-            
+        # Walk the categorized lists rather than every cell in the sheet; most
+        # sheets are largely numeric and only text cells can carry a label
+        for cell in text_cells:
             # Look for cells that might be totals/summaries
-            if isinstance(value, str):
-                value_lower = value.lower()
-                if any(keyword in value_lower for keyword in ["total", "sum", "revenue", "profit", "loss", "net", "gross", "ebitda"]):
-                    summary_indicators.append({
-                        "cell_ref": cell_ref,
-                        "text": value,
-                        "indicator_type": "text_summary_label"
-                    })
-            
-            elif isinstance(value, (int, float)):
-                # Large round numbers in bold formatting are often summaries
-                if (abs(value) >= 100000 and 
-                    value % 1000 == 0 and 
-                    cell_info.get("font", {}).get("bold", False)):
-                    summary_indicators.append({
-                        "cell_ref": cell_ref,
-                        "value": value,
-                        "indicator_type": "numeric_summary_value"
-                    })
+            if SUMMARY_KEYWORD_PATTERN.search(cell["value"]):
+                summary_indicators.append({
+                    "cell_ref": cell["cell_ref"],
+                    "text": cell["value"],
+                    "indicator_type": "text_summary_label"
+                })
+        
+        for cell in numeric_cells:
+            value = cell["value"]
+            # Large round numbers in bold formatting are often summaries
+            if (abs(value) >= 100000 and 
+                value % 1000 == 0 and 
+                cell.get("font", {}).get("bold", False)):
+                summary_indicators.append({
+                    "cell_ref": cell["cell_ref"],
+                    "value": value,
+                    "indicator_type": "numeric_summary_value"
+                })
         
         return summary_indicators
 
@@ -1,13 +1,19 @@
-import PyPDF2
 import fitz  # PyMuPDF
-from typing import List, Dict, Any, Tuple
+from pypdf import PdfReader
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
 import structlog
 from io import BytesIO
+import asyncio
 import base64
+import re
 from PIL import Image
 
+from app.utils.concurrency import run_mupdf
+
 logger = structlog.get_logger()
 
+_DIGIT = re.compile(r"\d")
+
 class PDFService:
     def __init__(self):
         pass
@@ -15,21 +21,43 @@ class PDFService:
     async def extract_text_and_images(self, file_content: bytes) -> Tuple[str, List[Dict[str, Any]]]:
         """Extract text and images from PDF"""
         try:
-            # Extract text using PyPDF2
-            text_content = await self._extract_text_pypdf2(file_content)
-            
-            # Extract images and detailed layout using PyMuPDF
-            images_and_layout = await self._extract_images_and_layout(file_content)
+            # PyMuPDF gives us text, layout and images in one parse; it is
+            # blocking, so it runs on the MuPDF thread
+            try:
+                images_and_layout = await run_mupdf(self._extract_images_and_layout, file_content)
+            except Exception as e:
+                logger.warning("PyMuPDF extraction failed, falling back to pypdf text only", error=str(e))
+                text_content = await asyncio.to_thread(self._extract_text_pypdf, file_content)
+                return text_content, []
             
-            return text_content, images_and_layout
+            return self._text_from_layout(images_and_layout), images_and_layout
             
         except Exception as e:
             logger.error("PDF extraction failed", error=str(e))
             raise
     
-    async def _extract_text_pypdf2(self, file_content: bytes) -> str:
-        """Extract text using PyPDF2"""
-        pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
+    async def extract_text(self, file_content: bytes) -> str:
+        """Extract page-delimited text only, streaming one page at a time"""
+        try:
+            return await run_mupdf(self._extract_text_mupdf, file_content)
+        except Exception as e:
+            logger.warning("PyMuPDF extraction failed, falling back to pypdf text only", error=str(e))
+            return await asyncio.to_thread(self._extract_text_pypdf, file_content)
+    
+    def _extract_text_mupdf(self, file_content: bytes) -> str:
+        # Only the running text is kept; each page's layout is dropped as soon as it is read
+        return self._text_from_layout(self.iter_pages(file_content, text_only=True))
+    
+    def _text_from_layout(self, pages_data: Iterable[Dict[str, Any]]) -> str:
+        """Document text assembled from the page text PyMuPDF already extracted"""
+        return "".join(
+            f"\n--- Page {page_data['page_number']} ---\n{page_data['text']}\n"
+            for page_data in pages_data
+        )
+    
+    def _extract_text_pypdf(self, file_content: bytes) -> str:
+        """Extract text using pypdf (fallback when PyMuPDF cannot open the file)"""
+        pdf_reader = PdfReader(BytesIO(file_content))
         text_content = ""
         
         for page_num, page in enumerate(pdf_reader.pages):
@@ -38,71 +66,83 @@ class PDFService:
         
         return text_content
     
-    async def _extract_images_and_layout(self, file_content: bytes) -> List[Dict[str, Any]]:
+    def _extract_images_and_layout(self, file_content: bytes) -> List[Dict[str, Any]]:
         """Extract images and layout information using PyMuPDF"""
-        doc = fitz.open(stream=file_content, filetype="pdf")
-        pages_data = []
+        return list(self.iter_pages(file_content))
+    
+    def iter_pages(self, file_content: bytes, text_only: bool = False) -> Iterator[Dict[str, Any]]:
+        """Yield per-page layout dicts one at a time (blocking; run via run_mupdf).
+
+        With text_only, image and table extraction are skipped.
+        """
+        with fitz.open(stream=file_content, filetype="pdf") as doc:
+            for page_num, page in enumerate(doc):
+                yield self._page_data(doc, page, page_num, text_only)
+    
+    def _page_data(self, doc, page, page_num: int, text_only: bool) -> Dict[str, Any]:
+        """Text blocks, images and tables for a single page"""
+        page_data = {
+            "page_number": page_num + 1,
+            "text_blocks": [],
+            "images": [],
+            "tables": []
+        }
         
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            page_data = {
-                "page_number": page_num + 1,
-                "text_blocks": [],
-                "images": [],
-                "tables": []
-            }
-            
-            # Extract text blocks with positioning
-            text_dict = page.get_text("dict")
-            for block in text_dict["blocks"]:
-                if "lines" in block:
-                    block_text = ""
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            block_text += span["text"] + " "
-                    
-                    if block_text.strip():
-                        page_data["text_blocks"].append({
-                            "text": block_text.strip(),
-                            "bbox": block["bbox"],  # [x0, y0, x1, y1]
-                            "font_size": line["spans"][0]["size"] if line["spans"] else 12
-                        })
-            
-            # Extract images
-            image_list = page.get_images()
-            for img_index, img in enumerate(image_list):
-                try:
-                    xref = img[0]
-                    pix = fitz.Pixmap(doc, xref)
-                    
-                    if pix.n - pix.alpha < 4:  # GRAY or RGB
-                        img_data = pix.tobytes("png")
-                        img_base64 = base64.b64encode(img_data).decode()
-                        
-                        page_data["images"].append({
-                            "index": img_index,
-                            "data": img_base64,
-                            "format": "png",
-                            "bbox": page.get_image_bbox(img)
-                        })
-                    
-                    pix = None
+        # Extract text blocks with positioning; the same pass collects the
+        # plain page text line by line
+        text_dict = page.get_text("dict")
+        page_lines = []
+        for block in text_dict["blocks"]:
+            if "lines" in block:
+                block_text = ""
+                for line in block["lines"]:
+                    for span in line["spans"]:
+                        block_text += span["text"] + " "
+                    page_lines.append("".join(span["text"] for span in line["spans"]))
+                
+                if block_text.strip():
+                    page_data["text_blocks"].append({
+                        "text": block_text.strip(),
+                        "bbox": block["bbox"],  # [x0, y0, x1, y1]
+                        "font_size": line["spans"][0]["size"] if line["spans"] else 12
+                    })
+        
+        page_data["text"] = "\n".join(page_lines)
+        
+        if text_only:
+            return page_data
+        
+        # Extract images
+        image_list = page.get_images()
+        for img_index, img in enumerate(image_list):
+            try:
+                xref = img[0]
+                pix = fitz.Pixmap(doc, xref)
+                
+                if pix.n - pix.alpha < 4:  # GRAY or RGB
+                    img_data = pix.tobytes("png")
+                    img_base64 = base64.b64encode(img_data).decode()
                     
-                except Exception as e:
-                    logger.warning("Failed to extract image", page=page_num, image=img_index, error=str(e))
-            
-            # Extract tables using simple heuristics
-            tables = self._extract_tables_from_page(page)
-            page_data["tables"] = tables
-            
-            pages_data.append(page_data)
+                    page_data["images"].append({
+                        "index": img_index,
+                        "data": img_base64,
+                        "format": "png",
+                        "bbox": page.get_image_bbox(img)
+                    })
+                
+                pix = None
+                
+            except Exception as e:
+                logger.warning("Failed to extract image", page=page_num, image=img_index, error=str(e))
         
-        doc.close()
-        return pages_data
+        # Extract tables using simple heuristics, reusing the parsed text layout
+        tables = self._extract_tables_from_page(text_dict)
+        page_data["tables"] = tables
+        
+        return page_data
     
-    def _extract_tables_from_page(self, page) -> List[Dict[str, Any]]:
-        """Extract tables using text positioning heuristics"""
-        text_dict = page.get_text("dict")
+    def _extract_tables_from_page(self, text_dict: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Extract tables from a page's get_text("dict") layout using positioning heuristics"""
         tables = []
         
         # Simple table detection based on aligned text blocks
@@ -150,19 +190,10 @@ class PDFService:
         return tables
     
     def _looks_like_table_row(self, text: str) -> bool:
-        """Simple heuristic to identify potential table rows"""
-        words = text.split()
-        if len(words) < 2:
-            return False
-        
-        # Count numeric values
-        numeric_count = sum(1 for word in words if self._contains_number(word))
-        return numeric_count >= 1 and len(words) >= 2
-    
-    def _contains_number(self, text: str) -> bool:
-        """Check if text contains numerical data"""
-        import re
-        return bool(re.search(r'\d', text))
+        """Simple heuristic to identify potential table rows: two or more words, at least one numeric"""
+        # A digit anywhere in the line is a digit in one of its words, so one
+        # regex search over the line replaces a per-word check
+        return len(text.split()) >= 2 and _DIGIT.search(text) is not None
     
     def _process_table_blocks(self, table_blocks: List[Dict]) -> Dict[str, Any]:
         """Process a group of table blocks into structured table data"""
@@ -0,0 +1,90 @@
+import structlog
+from cachetools import TTLCache
+from typing import Optional, Union
+import hashlib
+import threading
+
+from app.config import get_settings
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError
+except ImportError:  # Redis is optional; fall back to the in-process cache
+    aioredis = None
+    RedisError = OSError
+
+logger = structlog.get_logger()
+
+class AIResponseCache:
+    """Cache of raw AI responses keyed by a hash of the model name and prompt.
+
+    Uses Redis when REDIS_URL is reachable so every worker shares hits, and an
+    in-process TTL cache otherwise.
+    """
+
+    def __init__(self, maxsize: int = 512):
+        self._local: Optional[TTLCache] = None
+        self._local_lock = threading.Lock()
+        self._maxsize = maxsize
+        self._redis = None
+        self._redis_checked = False
+
+    @staticmethod
+    def key_for(model: str, *parts: Union[str, bytes]) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode() if isinstance(part, str) else part)
+            digest.update(b"\0")
+        return f"ai:{model}:{digest.hexdigest()}"
+
+    @property
+    def enabled(self) -> bool:
+        return get_settings().ENABLE_CACHING
+
+    def _local_cache(self) -> TTLCache:
+        # Callers hold _local_lock
+        if self._local is None:
+            self._local = TTLCache(maxsize=self._maxsize, ttl=get_settings().CACHE_TTL_SECONDS)
+        return self._local
+
+    async def _client(self):
+        if not self._redis_checked:
+            self._redis_checked = True
+            if aioredis is not None:
+                client = aioredis.from_url(get_settings().REDIS_URL, socket_connect_timeout=1, socket_timeout=1)
+                try:
+                    await client.ping()
+                    self._redis = client
+                except (RedisError, OSError) as e:
+                    logger.info("Redis unavailable, caching AI responses in process", error=str(e))
+        return self._redis
+
+    async def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        client = await self._client()
+        if client is not None:
+            try:
+                value = await client.get(key)
+                return value.decode() if value is not None else None
+            except RedisError as e:
+                logger.warning("AI cache read failed", error=str(e))
+                return None
+        with self._local_lock:
+            return self._local_cache().get(key)
+
+    async def set(self, key: str, value: str) -> None:
+        if not self.enabled:
+            return
+        client = await self._client()
+        if client is not None:
+            try:
+                await client.setex(key, get_settings().CACHE_TTL_SECONDS, value)
+            except RedisError as e:
+                logger.warning("AI cache write failed", error=str(e))
+            return
+        with self._local_lock:
+            self._local_cache()[key] = value
+
+# Singleton instance
+ai_response_cache = AIResponseCache()
@@ -0,0 +1,28 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, TypeVar
+import asyncio
+import multiprocessing
+import os
+
+T = TypeVar("T")
+
+# PyMuPDF is not safe to call from several threads at once, so every fitz call
+# goes through this single worker: off the event loop, but never concurrent.
+MUPDF_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mupdf")
+
+async def run_mupdf(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking PyMuPDF call on the dedicated MuPDF thread"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(MUPDF_EXECUTOR, partial(func, *args, **kwargs))
+
+# CPU-bound parsing (openpyxl workbooks) runs in worker processes, where it
+# neither holds the GIL against the event loop nor queues behind other uploads.
+# Workers are spawned, not forked, because the parent holds gRPC channels and
+# threads. Functions sent here must be importable module-level callables.
+PARSE_EXECUTOR = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+
+async def run_in_process(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a CPU-bound call in the parse process pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(PARSE_EXECUTOR, partial(func, *args, **kwargs))
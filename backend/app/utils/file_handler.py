@@ -0,0 +1,9 @@
+import hashlib
+
+def file_fingerprint(path: str) -> str:
+    """SHA-256 of a file's contents, read in C without loading the whole file.
+
+    Blocking; call through asyncio.to_thread from async code.
+    """
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
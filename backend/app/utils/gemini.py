@@ -0,0 +1,15 @@
+from functools import lru_cache
+from typing import Optional
+import google.generativeai as genai
+
+# genai keeps one transport client per process and configure() throws it away,
+# so configure once per key and hand every service the same model objects.
+
+@lru_cache(maxsize=1)
+def configure_gemini(api_key: str) -> None:
+    genai.configure(api_key=api_key)
+
+@lru_cache(maxsize=None)
+def get_gemini_model(model_name: str, system_instruction: Optional[str] = None) -> genai.GenerativeModel:
+    """Shared GenerativeModel for a model name and system instruction"""
+    return genai.GenerativeModel(model_name, system_instruction=system_instruction)
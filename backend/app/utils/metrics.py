@@ -1,8 +1,9 @@
 import structlog
 from prometheus_client import Counter, Histogram, Gauge, start_http_server
 from app.models.document import UsageMetrics
-from app.database.database import get_db
-from typing import Optional
+from app.database.database import AsyncSessionLocal
+from typing import Coroutine, Optional, Set
+import asyncio
 import time
 import uuid
 
@@ -15,11 +16,21 @@ AI_TOKEN_USAGE = Counter('veritas_ai_tokens_total', 'AI tokens used', ['model',
 AI_COST = Counter('veritas_ai_cost_total', 'AI cost in USD', ['model', 'operation'])
 ACTIVE_SESSIONS = Gauge('veritas_active_sessions', 'Number of active audit sessions')
 
+# Strong references to in-flight metric writes; the event loop only keeps weak ones
+_pending_metric_tasks: Set[asyncio.Task] = set()
+
 def setup_metrics():
     """Setup Prometheus metrics server"""
     start_http_server(8001)
     logger.info("Metrics server started on port 8001")
 
+def record_in_background(coro: Coroutine) -> asyncio.Task:
+    """Schedule a metrics coroutine without blocking the caller on it"""
+    task = asyncio.create_task(coro)
+    _pending_metric_tasks.add(task)
+    task.add_done_callback(_pending_metric_tasks.discard)
+    return task
+
 async def track_operation(operation_type: str, latency_ms: float, success: bool, session_id: str, error_message: Optional[str] = None):
     """Track operation metrics"""
     status = "success" if success else "error"
@@ -30,16 +41,16 @@ async def track_operation(operation_type: str, latency_ms: float, success: bool,
     
     # Save to database
     try:
-        db = next(get_db())
-        usage_record = UsageMetrics(
-            session_id=session_id,
-            operation_type=operation_type,
-            latency_ms=latency_ms,
-            success=success,
-            error_message=error_message
-        )
-        db.add(usage_record)
-        db.commit()
+        async with AsyncSessionLocal() as db:
+            usage_record = UsageMetrics(
+                session_id=session_id,
+                operation_type=operation_type,
+                latency_ms=latency_ms,
+                success=success,
+                error_message=error_message
+            )
+            db.add(usage_record)
+            await db.commit()
     except Exception as e:
         logger.error("Failed to save usage metrics", error=str(e))
 
@@ -62,18 +73,18 @@ async def track_ai_usage(operation_type: str, model: str, tokens_used: Optional[
     
     # Save to database
     try:
-        db = next(get_db())
-        usage_record = UsageMetrics(
-            session_id=str(uuid.uuid4()),
-            operation_type=operation_type,
-            ai_model_used=model,
-            tokens_used=tokens_used,
-            cost_usd=estimated_cost if tokens_used else None,
-            latency_ms=latency_ms,
-            success=success,
-            error_message=error_message
-        )
-        db.add(usage_record)
-        db.commit()
+        async with AsyncSessionLocal() as db:
+            usage_record = UsageMetrics(
+                session_id=str(uuid.uuid4()),
+                operation_type=operation_type,
+                ai_model_used=model,
+                tokens_used=tokens_used,
+                cost_usd=estimated_cost if tokens_used else None,
+                latency_ms=latency_ms,
+                success=success,
+                error_message=error_message
+            )
+            db.add(usage_record)
+            await db.commit()
     except Exception as e:
         logger.error("Failed to save AI usage metrics", error=str(e))
\ No newline at end of file
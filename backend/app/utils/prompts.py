@@ -0,0 +1,11 @@
+from typing import Any
+import orjson
+
+def compact_json(value: Any) -> str:
+    """Serialize data for embedding in a prompt.
+
+    orjson writes no indentation or separator spaces (each of which costs
+    tokens) and encodes datetimes natively; anything else it does not know,
+    such as Decimal cell values, falls back to str().
+    """
+    return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
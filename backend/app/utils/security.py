@@ -1,6 +1,10 @@
 from datetime import datetime, timedelta
 from typing import Any, Union, Dict
-from jose import jwt
+import hashlib
+import threading
+import time
+from cachetools import TTLCache
+from jose import jwk, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException
 
@@ -8,6 +12,15 @@ from app.config import settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Signing key built once. Given the raw secret, jose re-parses it on every
+# encode/decode (including a json.loads attempt) before reaching the HMAC
+_signing_key = jwk.construct(settings.SECRET_KEY, settings.ALGORITHM)
+
+# Verified token payloads keyed by SHA-256 of the raw token. Only successful
+# verifications are stored; the token's own "exp" claim still bounds reuse.
+_token_cache = TTLCache(maxsize=10_000, ttl=settings.JWT_CACHE_TTL_SECONDS)
+_token_cache_lock = threading.Lock()
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plain password against its hash"""
     return pwd_context.verify(plain_password, hashed_password)
@@ -18,20 +31,30 @@ def get_password_hash(password: str) -> str:
 
 def create_access_token(data: Dict[str, Any], expires_delta: Union[timedelta, None] = None) -> str:
     """Create JWT access token"""
-    to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
-    return encoded_jwt
+    # Claims built in one step; the caller's dict is left untouched
+    return jwt.encode({**data, "exp": expire}, _signing_key, algorithm=settings.ALGORITHM)
 
 def verify_token(token: str) -> Dict[str, Any]:
     """Verify JWT token and return payload"""
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    key = hashlib.sha256(token.encode()).digest()
+    
+    with _token_cache_lock:
+        payload = _token_cache.get(key)
+    if payload is not None and payload.get("exp", 0) > time.time():
         return payload
+    
+    try:
+        payload = jwt.decode(token, _signing_key, algorithms=[settings.ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
     except jwt.JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
\ No newline at end of file
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    with _token_cache_lock:
+        _token_cache[key] = payload
+    return payload
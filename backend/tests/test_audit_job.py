@@ -0,0 +1,137 @@
+import asyncio
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+
+from app.api import audit as audit_api
+from app.database.database import get_db
+from app.deps import get_current_user
+from app.models.document import AuditSession, Base, ValidationResult
+
+
+@pytest.fixture
+def audit_app(tmp_path, monkeypatch):
+    """The audit router on a throwaway SQLite database, with the audit itself and metrics faked"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'audit.db'}")
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create_tables())
+
+    async def override_get_db():
+        async with session_factory() as db:
+            yield db
+
+    tracked = []
+
+    async def fake_track_operation(operation_type, latency_ms, success, session_id, error_message=None):
+        tracked.append((success, error_message))
+
+    monkeypatch.setattr(audit_api, "AsyncSessionLocal", session_factory)
+    monkeypatch.setattr(audit_api, "track_operation", fake_track_operation)
+
+    app = FastAPI()
+    app.include_router(audit_api.router, prefix="/api/audit")
+    app.dependency_overrides[get_current_user] = lambda: {"sub": "user-1"}
+    app.dependency_overrides[get_db] = override_get_db
+
+    yield app, session_factory, tracked
+    asyncio.run(engine.dispose())
+
+
+def _stored(session_factory, session_id):
+    async def load():
+        async with session_factory() as db:
+            session = await db.get(AuditSession, session_id)
+            rows = await db.scalar(
+                select(func.count()).select_from(ValidationResult).where(ValidationResult.audit_session_id == session_id)
+            )
+            return session, rows
+
+    return asyncio.run(load())
+
+
+def _start_audit(client):
+    session_id = client.post(
+        "/api/audit/sessions", json={"pdf_document_id": 1, "excel_document_ids": [2]}
+    ).json()["session_id"]
+    response = client.post(f"/api/audit/sessions/{session_id}/run", json={"pdf_data": {"slides": []}})
+    return session_id, response
+
+
+def test_run_audit_stores_results_in_background(audit_app, monkeypatch):
+    app, session_factory, tracked = audit_app
+
+    async def fake_audit(pdf_data, excel_data, user_mappings):
+        return {
+            "summary": {"total_validations": 1},
+            "detailed_results": [
+                {"pdf_slide": 1, "pdf_value": "1.2M", "excel_value": 1200000, "validation_status": "matched"}
+            ],
+        }
+
+    monkeypatch.setattr(audit_api.audit_service, "run_comprehensive_audit", fake_audit)
+
+    with TestClient(app) as client:
+        session_id, response = _start_audit(client)
+
+    assert response.status_code == 202
+    assert response.json()["status"] == "in_progress"
+    assert response.json()["status_url"].endswith(f"/api/audit/sessions/{session_id}")
+
+    session, rows = _stored(session_factory, session_id)
+    assert session.status == "completed"
+    assert session.audit_results["summary"] == {"total_validations": 1}
+    assert session.completion_date is not None
+    assert rows == 1
+    assert tracked == [(True, None)]
+
+
+def test_run_audit_marks_session_failed_when_audit_raises(audit_app, monkeypatch, caplog):
+    app, session_factory, tracked = audit_app
+
+    async def failing_audit(pdf_data, excel_data, user_mappings):
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(audit_api.audit_service, "run_comprehensive_audit", failing_audit)
+
+    with TestClient(app) as client:
+        session_id, response = _start_audit(client)
+
+    assert response.status_code == 202
+
+    session, rows = _stored(session_factory, session_id)
+    assert session.status == "failed"
+    assert rows == 0
+    assert tracked == [(False, "model unavailable")]
+    assert any(record.exc_info and "model unavailable" in record.getMessage() for record in caplog.records)
+
+
+def test_audit_failure_is_logged_when_status_write_fails(monkeypatch, caplog):
+    async def failing_audit(pdf_data, excel_data, user_mappings):
+        raise RuntimeError("model unavailable")
+
+    def broken_session_factory():
+        raise ConnectionError("database is gone")
+
+    async def fake_track_operation(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(audit_api.audit_service, "run_comprehensive_audit", failing_audit)
+    monkeypatch.setattr(audit_api, "AsyncSessionLocal", broken_session_factory)
+    monkeypatch.setattr(audit_api, "track_operation", fake_track_operation)
+
+    asyncio.run(audit_api._run_audit_job(1, {}, {}, {}))
+
+    messages = [record.getMessage() for record in caplog.records if record.exc_info]
+    assert any("model unavailable" in message for message in messages)
+    assert any("Could not mark audit session 1 as failed" in message for message in messages)
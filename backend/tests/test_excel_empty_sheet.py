@@ -0,0 +1,58 @@
+import asyncio
+import io
+import os
+import re
+import zipfile
+
+import openpyxl
+
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+
+from app.services.enhanced_ai_service import enhanced_gemini_service
+from app.services.excel_service import excel_service, sheet_extent
+
+
+def _workbook_with_undimensioned_empty_sheet() -> bytes:
+    """Two filled sheets and one empty sheet, with every <dimension> record removed"""
+    wb = openpyxl.Workbook()
+    wb.active.title = "Revenue"
+    wb.active.append(["Quarter", "Revenue"])
+    wb.active.append(["Q1", 1250000])
+    wb.create_sheet("Empty")
+    costs = wb.create_sheet("Costs")
+    costs.append(["Quarter", "Cost"])
+    costs.append(["Q1", 400000])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+
+    stripped = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(buffer.getvalue())) as src, zipfile.ZipFile(stripped, "w") as dst:
+        for item in src.infolist():
+            data = src.read(item.filename)
+            if item.filename.startswith("xl/worksheets/"):
+                data = re.sub(rb"<dimension[^>]*/>", b"", data)
+            dst.writestr(item, data)
+    return stripped.getvalue()
+
+
+def test_sheet_extent_of_undimensioned_sheets():
+    wb = openpyxl.load_workbook(io.BytesIO(_workbook_with_undimensioned_empty_sheet()), read_only=True)
+    try:
+        assert sheet_extent(wb["Revenue"]) == (2, 2)
+        assert sheet_extent(wb["Empty"]) == (1, 1)
+    finally:
+        wb.close()
+
+
+def test_excel_service_processes_undimensioned_empty_sheet():
+    result = asyncio.run(excel_service.extract_data_comprehensive(_workbook_with_undimensioned_empty_sheet()))
+    assert result["comprehensive_statistics"]["processed_sheets"] == 3
+    assert result["comprehensive_statistics"]["sheets_skipped"] == 0
+
+
+def test_workbook_structures_include_undimensioned_empty_sheet(tmp_path):
+    path = tmp_path / "book.xlsx"
+    path.write_bytes(_workbook_with_undimensioned_empty_sheet())
+    total, structures = enhanced_gemini_service._extract_workbook_structures(str(path))
+    assert total == 3
+    assert [name for name, _ in structures] == ["Revenue", "Empty", "Costs"]